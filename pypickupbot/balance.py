@@ -0,0 +1,325 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Team balancing
+
+Players are split into teams whose sizes differ by at most one, trying to
+minimize the gap between the strongest and the weakest team's mean rating.
+Everything here works on plain (player, rating) pairs so that it can be
+used and measured without a running bot.
+"""
+
+import random
+from time import time
+
+class Balance:
+    """Result of a balancing run
+
+    @ivar teams: list of player lists, one per team
+    @ivar means: mean rating of each team
+    @ivar gap: difference between the highest and lowest mean rating
+    @ivar method: name of the method that produced this result
+    @ivar exact: whether the result is known to be optimal
+    """
+
+    def __init__(self, teams, means, method, exact=False):
+        self.teams = teams
+        self.means = means
+        self.gap = max(means) - min(means) if means else 0
+        self.method = method
+        self.exact = exact
+
+    def __repr__(self):
+        return "<Balance {0} gap={1:.1f}{2}>".format(
+            self.method, self.gap, " (exact)" if self.exact else "")
+
+class _Problem:
+    """Shared state of one balancing run"""
+
+    def __init__(self, ratings, nteams, fixed, budget):
+        self.players = [player for player, rating in ratings]
+        known = [rating for player, rating in ratings if rating != None]
+        # players without a rating count as average ones
+        default = float(sum(known)) / len(known) if known else 0.
+        self.ratings = [default if rating == None else float(rating)
+            for player, rating in ratings]
+        self.n = len(ratings)
+        self.nteams = nteams
+        self.sizes = [self.n // nteams + (1 if i < self.n % nteams else 0)
+            for i in range(nteams)]
+        self.fixed = fixed or {}
+        self.deadline = time() + budget
+
+    def out_of_time(self):
+        return time() > self.deadline
+
+    def gap(self, assignment):
+        sums = [0.] * self.nteams
+        for i, team in enumerate(assignment):
+            sums[team] += self.ratings[i]
+        means = [s / size for s, size in zip(sums, self.sizes) if size]
+        return max(means) - min(means) if means else 0
+
+    def result(self, assignment, method, exact=False):
+        teams = [[] for i in range(self.nteams)]
+        sums = [0.] * self.nteams
+        for i, team in enumerate(assignment):
+            teams[team].append(self.players[i])
+            sums[team] += self.ratings[i]
+        means = [s / size for s, size in zip(sums, self.sizes) if size]
+        return Balance(teams, means, method, exact)
+
+    def fixed_start(self):
+        """Team counts and sums with only fixed players assigned"""
+        counts = [0] * self.nteams
+        sums = [0.] * self.nteams
+        for i, team in self.fixed.iteritems():
+            counts[team] += 1
+            sums[team] += self.ratings[i]
+        return counts, sums
+
+def _alternate(problem):
+    """Teams take turns picking, like captains would: a team above the
+    others' mean picks the weakest player left, one below picks the
+    strongest."""
+    assignment = [None] * problem.n
+    counts, sums = problem.fixed_start()
+    for i, team in problem.fixed.iteritems():
+        assignment[i] = team
+    pool = [i for i in range(problem.n) if i not in problem.fixed]
+
+    turn = 0
+    while pool:
+        while counts[turn] >= problem.sizes[turn]:
+            turn = (turn + 1) % problem.nteams
+        means = [s / c for s, c in zip(sums, counts) if c]
+        own = sums[turn] / counts[turn] if counts[turn] else None
+        others = [m for t, m in enumerate(means) if t != turn]
+        if own != None and others and own > sum(others) / len(others):
+            pick = min(pool, key=lambda i: problem.ratings[i])
+        else:
+            pick = max(pool, key=lambda i: problem.ratings[i])
+        pool.remove(pick)
+        assignment[pick] = turn
+        counts[turn] += 1
+        sums[turn] += problem.ratings[pick]
+        turn = (turn + 1) % problem.nteams
+    return assignment
+
+def _greedy(problem):
+    """Strongest players first, each to the team with room and the lowest
+    total rating"""
+    assignment = [None] * problem.n
+    counts, sums = problem.fixed_start()
+    for i, team in problem.fixed.iteritems():
+        assignment[i] = team
+    order = sorted((i for i in range(problem.n) if i not in problem.fixed),
+        key=lambda i: problem.ratings[i], reverse=True)
+    for i in order:
+        team = min((t for t in range(problem.nteams)
+                if counts[t] < problem.sizes[t]),
+            key=lambda t: sums[t] / problem.sizes[t])
+        assignment[i] = team
+        counts[team] += 1
+        sums[team] += problem.ratings[i]
+    return assignment
+
+def _local_search(problem, assignment):
+    """Swaps players between teams as long as it narrows the gap"""
+    assignment = assignment[:]
+    ratings = problem.ratings
+    sizes = problem.sizes
+    sums = [0.] * problem.nteams
+    for i, team in enumerate(assignment):
+        sums[team] += ratings[i]
+
+    def _gap():
+        means = [s / size for s, size in zip(sums, sizes) if size]
+        return max(means) - min(means) if means else 0
+
+    movable = [i for i in range(problem.n) if i not in problem.fixed]
+    best = _gap()
+    improved = True
+    while improved and best > 0 and not problem.out_of_time():
+        improved = False
+        for x, a in enumerate(movable):
+            for b in movable[x+1:]:
+                ta, tb = assignment[a], assignment[b]
+                delta = ratings[b] - ratings[a]
+                if ta == tb or not delta:
+                    continue
+                sums[ta] += delta
+                sums[tb] -= delta
+                gap = _gap()
+                if gap < best:
+                    best = gap
+                    assignment[a], assignment[b] = tb, ta
+                    improved = True
+                else:
+                    sums[ta] -= delta
+                    sums[tb] += delta
+            if problem.out_of_time():
+                break
+    return assignment
+
+def _exact(problem, initial):
+    """Branch and bound over all assignments, strongest players first.
+
+    @returns: the best assignment found and whether the search completed
+        within the time budget"""
+    order = sorted((i for i in range(problem.n) if i not in problem.fixed),
+        key=lambda i: problem.ratings[i], reverse=True)
+    rest = [problem.ratings[i] for i in order]
+    # prefix[k] is the sum of the k first (strongest) remaining ratings
+    prefix = [0.]
+    for r in rest:
+        prefix.append(prefix[-1] + r)
+
+    counts, sums = problem.fixed_start()
+    sizes = problem.sizes
+    nteams = problem.nteams
+    assignment = [None] * problem.n
+    for i, team in problem.fixed.iteritems():
+        assignment[i] = team
+
+    state = {
+        'best': problem.gap(initial),
+        'best_assignment': initial[:],
+        'nodes': 0,
+        'timeout': False,
+        }
+
+    def _bound(depth):
+        """Lowest gap any completion of the current assignment can reach"""
+        left = len(rest) - depth
+        lowest_high = None
+        highest_low = None
+        for t in range(nteams):
+            if not sizes[t]:
+                continue
+            slots = sizes[t] - counts[t]
+            # strongest and weakest players this team could still get
+            high = (sums[t] + prefix[depth + slots] - prefix[depth]) / sizes[t]
+            low = (sums[t] + prefix[depth + left] - prefix[depth + left - slots]) / sizes[t]
+            if lowest_high == None or high < lowest_high:
+                lowest_high = high
+            if highest_low == None or low > highest_low:
+                highest_low = low
+        return highest_low - lowest_high
+
+    def _search(depth):
+        state['nodes'] += 1
+        if state['nodes'] & 255 == 0 and problem.out_of_time():
+            state['timeout'] = True
+        if state['timeout'] or state['best'] <= 0:
+            return
+        if depth == len(order):
+            gap = problem.gap(assignment)
+            if gap < state['best']:
+                state['best'] = gap
+                state['best_assignment'] = assignment[:]
+            return
+        if _bound(depth) >= state['best']:
+            return
+        i = order[depth]
+        tried_empty = set()
+        for t in range(nteams):
+            if counts[t] >= sizes[t]:
+                continue
+            if counts[t] == 0:
+                # empty teams of the same size are interchangeable
+                if sizes[t] in tried_empty:
+                    continue
+                tried_empty.add(sizes[t])
+            assignment[i] = t
+            counts[t] += 1
+            sums[t] += problem.ratings[i]
+            _search(depth + 1)
+            counts[t] -= 1
+            sums[t] -= problem.ratings[i]
+        assignment[i] = None
+
+    _search(0)
+    return state['best_assignment'], not state['timeout']
+
+def alternate(problem):
+    return problem.result(_alternate(problem), 'alternate')
+
+def local(problem):
+    return problem.result(
+        _local_search(problem, _greedy(problem)), 'local')
+
+def exact(problem):
+    assignment, complete = _exact(problem,
+        _local_search(problem, _greedy(problem)))
+    return problem.result(assignment, 'exact', complete)
+
+def auto(problem):
+    if problem.n <= EXACT_LIMIT:
+        return exact(problem)
+    return local(problem)
+
+EXACT_LIMIT = 16
+
+methods = {
+    'alternate': alternate,
+    'local': local,
+    'exact': exact,
+    'auto': auto,
+    }
+
+def balance(ratings, nteams=2, fixed=None, method='auto', budget=0.005):
+    """Splits players into teams
+
+    @param ratings: list of (player, rating) pairs, rating may be None for
+        players without one, who are then considered average
+    @param nteams: number of teams to create
+    @param fixed: {index in ratings: team index} of players whose team is
+        already decided, such as captains
+    @param method: one of L{methods}
+    @param budget: time in seconds after which searching stops and the best
+        split found so far is returned
+    @rtype: L{Balance}
+    """
+    if method not in methods:
+        raise ValueError("Unknown balancing method: %s" % method)
+    problem = _Problem(ratings, nteams, fixed, budget)
+    return methods[method](problem)
+
+def pick_captains(ratings, n):
+    """Picks a random rated captain, then the n-1 players closest to them
+    in rating. Players without a rating are only picked when there aren't
+    enough rated ones.
+
+    @returns: indexes in ratings of the captains"""
+    rated = [i for i, (player, rating) in enumerate(ratings) if rating != None]
+    unrated = [i for i, (player, rating) in enumerate(ratings) if rating == None]
+    n = min(n, len(ratings))
+    if not rated:
+        return random.sample(unrated, n)
+    first = random.choice(rated)
+    others = sorted((i for i in rated if i != first),
+        key=lambda i: abs(ratings[i][1] - ratings[first][1]))
+    captains = [first] + others[:n-1]
+    if len(captains) < n:
+        captains.extend(random.sample(unrated, n - len(captains)))
+    return captains
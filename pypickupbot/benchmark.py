@@ -0,0 +1,252 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Team balancing benchmark
+
+Runs captain selection and every balancing method on synthetic player
+pools and reports how long they take, how many objects they allocate and
+how uneven the resulting teams are. Launched by the pickupbot-benchmark
+script in top directory, eg. for 4v4, 8v8 and 5 teams of 4::
+
+    ./pickupbot-benchmark --players 8,16 --teams 2
+    ./pickupbot-benchmark --players 20 --teams 5 --unrated 0.2
+"""
+
+import gc
+import random
+import sys
+from time import time
+
+from twisted.python import usage
+
+from pypickupbot import balance
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+class Options(usage.Options):
+
+    optParameters = [
+        ['players', 'p', '8,16', "Comma-separated pool sizes to run"],
+        ['teams', 't', 2, "Number of teams", int],
+        ['runs', 'r', 200, "Pools generated for each size", int],
+        ['distribution', None, 'normal',
+            "Elo distribution: normal, uniform or bimodal"],
+        ['mean', None, 1000., "Mean Elo", float],
+        ['spread', None, 250., "Standard deviation of the Elo", float],
+        ['unrated', 'u', 0., "Fraction of players without an Elo", float],
+        ['budget', 'b', 5., "Time budget of each search, in milliseconds",
+            float],
+        ['methods', 'm', 'random,' + ','.join(sorted(balance.methods)),
+            "Comma-separated algorithms to run"],
+        ['seed', 's', None, "Random seed, for reproducible pools", int],
+    ]
+
+    def postOptions(self):
+        try:
+            self['players'] = [int(n) for n in self['players'].split(',')]
+        except ValueError:
+            raise usage.UsageError("--players takes a list of numbers")
+        if self['distribution'] not in distributions:
+            raise usage.UsageError("Unknown distribution: %s"
+                % self['distribution'])
+        self['methods'] = [m.strip() for m in self['methods'].split(',')]
+        for method in self['methods']:
+            if method not in algorithms:
+                raise usage.UsageError("Unknown method: %s" % method)
+        if self['teams'] < 1:
+            raise usage.UsageError("--teams must be at least 1")
+
+def _normal(mean, spread):
+    return random.gauss(mean, spread)
+
+def _uniform(mean, spread):
+    # same standard deviation as the normal distribution
+    half = spread * 3 ** .5
+    return random.uniform(mean - half, mean + half)
+
+def _bimodal(mean, spread):
+    return random.gauss(mean + random.choice((-spread, spread)), spread / 3)
+
+distributions = {
+    'normal': _normal,
+    'uniform': _uniform,
+    'bimodal': _bimodal,
+    }
+
+def make_pool(size, distribution='normal', mean=1000., spread=250.,
+        unrated=0.):
+    """Synthetic pool of (player, elo) pairs, a fraction of them without elo"""
+    draw = distributions[distribution]
+    return [("player{0}".format(i),
+            None if random.random() < unrated else round(draw(mean, spread), 1))
+        for i in range(size)]
+
+def _random(ratings, nteams, captain_ids, budget):
+    """What modules/pickup.py ends up with: random captains picking without
+    knowing anyone's rating"""
+    fixed = dict((i, t) for t, i in enumerate(captain_ids))
+    teams = [[ratings[i][0]] for i in captain_ids]
+    rest = [player for i, (player, elo) in enumerate(ratings)
+        if i not in fixed]
+    random.shuffle(rest)
+    for i, player in enumerate(rest):
+        teams[i % nteams].append(player)
+    return teams, False
+
+def _balancer(method):
+    def _run(ratings, nteams, captain_ids, budget):
+        result = balance.balance(ratings, nteams,
+            fixed=dict((i, t) for t, i in enumerate(captain_ids)),
+            method=method, budget=budget)
+        return result.teams, result.exact
+    return _run
+
+algorithms = {'random': _random}
+for method in balance.methods:
+    algorithms[method] = _balancer(method)
+
+def gap(ratings, teams):
+    """Gap between team means, unrated players counting as average ones
+    like L{balance.balance} does"""
+    known = [elo for player, elo in ratings if elo != None]
+    default = float(sum(known)) / len(known) if known else 0.
+    elos = dict((player, default if elo == None else elo)
+        for player, elo in ratings)
+    means = [sum(elos[p] for p in team) / len(team) for team in teams if team]
+    return max(means) - min(means) if means else 0
+
+class Stats:
+    """Aggregated measurements of one algorithm on one pool size"""
+
+    def __init__(self):
+        self.times = []
+        self.objects = []
+        self.peaks = []
+        self.gaps = []
+        self.exact = 0
+
+    def row(self, name, size):
+        runs = len(self.times)
+        times = sorted(self.times)
+        return [
+            name, size,
+            "{0:.3f}".format(sum(times) / runs * 1000),
+            "{0:.3f}".format(times[int(runs * .99) if runs > 1 else 0] * 1000),
+            "{0:.0f}".format(float(sum(self.objects)) / runs),
+            "{0:.1f}".format(float(sum(self.peaks)) / runs / 1024)
+                if self.peaks else "-",
+            "{0:.1f}".format(sum(self.gaps) / runs),
+            "{0:.1f}".format(max(self.gaps)),
+            "{0:.0f}%".format(100. * self.exact / runs),
+            ]
+
+header = ["algorithm", "players", "mean ms", "p99 ms", "objects",
+    "peak KiB", "mean gap", "max gap", "exact"]
+
+def _measure(stats, func, *args):
+    """Calls func, recording its wall time and allocations into stats.
+
+    Objects is how many more objects the garbage collector tracks during
+    the call, which is the number of containers (lists, dicts, tuples...)
+    allocated and not freed yet. The peak traced memory is only known when
+    tracemalloc is available."""
+    gc.collect()
+    gc.disable()
+    try:
+        if tracemalloc:
+            tracemalloc.start()
+        before = gc.get_count()[0]
+        start = time()
+        result = func(*args)
+        stats.times.append(time() - start)
+        stats.objects.append(max(0, gc.get_count()[0] - before))
+        if tracemalloc:
+            stats.peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    finally:
+        gc.enable()
+    return result
+
+def run(sizes, nteams, methods, runs, budget, **pool_options):
+    """Benchmarks methods on runs pools of each size
+
+    @returns: table rows, see L{header}"""
+    rows = []
+    for size in sizes:
+        stats = dict((name, Stats()) for name in ['captains'] + methods)
+        for i in range(runs):
+            ratings = make_pool(size, **pool_options)
+
+            captain_ids = _measure(stats['captains'],
+                balance.pick_captains, ratings, nteams)
+            captain_elos = [ratings[i][1] for i in captain_ids]
+            # the captains' own gap is how far apart their elos are
+            stats['captains'].gaps.append(
+                max(captain_elos) - min(captain_elos)
+                if None not in captain_elos else 0)
+
+            for name in methods:
+                teams, exact = _measure(stats[name], algorithms[name],
+                    ratings, nteams, captain_ids, budget)
+                stats[name].gaps.append(gap(ratings, teams))
+                if exact:
+                    stats[name].exact += 1
+        for name in ['captains'] + methods:
+            rows.append(stats[name].row(name, size))
+    return rows
+
+def format_table(rows):
+    widths = [max(len(str(row[i])) for row in [header] + rows)
+        for i in range(len(header))]
+    return '\n'.join(
+        '  '.join(str(cell).rjust(width) for cell, width in zip(row, widths))
+        for row in [header] + rows)
+
+def from_commandline():
+    """runs the benchmark
+
+    called by the pickupbot-benchmark script in top directory"""
+
+    options = Options()
+
+    try:
+        options.parseOptions()
+    except usage.UsageError as errortext:
+        print '%s: %s' % (sys.argv[0], errortext)
+        print '%s: Try --help for usage details.' % (sys.argv[0])
+        sys.exit(1)
+
+    if options['seed'] != None:
+        random.seed(options['seed'])
+
+    print "{0} teams, {1} runs per size, {2} elo {3:.0f}+-{4:.0f}, " \
+        "{5:.0%} unrated, {6}ms budget".format(
+            options['teams'], options['runs'], options['distribution'],
+            options['mean'], options['spread'], options['unrated'],
+            options['budget'])
+    print format_table(run(options['players'], options['teams'],
+        options['methods'], options['runs'], options['budget'] / 1000,
+        distribution=options['distribution'], mean=options['mean'],
+        spread=options['spread'], unrated=options['unrated']))
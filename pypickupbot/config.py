@@ -25,7 +25,7 @@ import re
 
 from ConfigParser import SafeConfigParser as CfgParser, NoSectionError, NoOptionError
 
-from pypickupbot.misc import timediff_from_str
+from pypickupbot.misc import timediff_from_str, Template
 
 defaults = {
     }
@@ -46,6 +46,17 @@ _parser = CfgParser(defaults)
 
 debug = False
 
+listeners = []
+"""Called without arguments whenever settings were read or changed"""
+
+_cache = {}
+
+def changed():
+    """Drops cached settings and tells L{listeners}"""
+    _cache.clear()
+    for listener in listeners[:]:
+        listener()
+
 def parse_init_configs(dir_=None):
     _parser.readfp(open(os.path.join(os.path.dirname(__file__), 'defaults.cfg')))
     if dir_ != None:
@@ -54,6 +65,7 @@ def parse_init_configs(dir_=None):
         _parser.read(init_configs)
     else:
         _parser.readfp((open(os.path.join(dir[0], 'init.cfg'))))
+    changed()
 
     debug = getboolean('Bot', 'debug')
 
@@ -62,26 +74,62 @@ def parse_configs():
         _parser.read(configs)
     else:
         _parser.readfp((open(os.path.join(dir[0], 'config.cfg'))))
-
+    changed()
+
+def read(filenames):
+    r = _parser.read(filenames)
+    changed()
+    return r
+
+def _changes(func):
+    def wrapper(*args, **kwargs):
+        r = func(*args, **kwargs)
+        changed()
+        return r
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+def _cached(func):
+    """Remembers what func returns for each setting until they change.
+
+    Values are stored as is, so they must not be mutable."""
+    def wrapper(section, option, *args):
+        if args:
+            return func(section, option, *args)
+        key = (func, section, option)
+        try:
+            return _cache[key]
+        except KeyError:
+            value = _cache[key] = func(section, option)
+            return value
+    wrapper.__doc__ = func.__doc__
+    return wrapper
 
 defaults = _parser.defaults
 sections = _parser.sections
-add_section = _parser.add_section
+add_section = _changes(_parser.add_section)
 has_section = _parser.has_section
 options = _parser.options
 has_option = _parser.has_option
-get = _parser.get
-getint = _parser.getint
-getfloat = _parser.getfloat
-getboolean = _parser.getboolean
+get = _cached(_parser.get)
+getint = _cached(_parser.getint)
+getfloat = _cached(_parser.getfloat)
+getboolean = _cached(_parser.getboolean)
 items = _parser.items
-set = _parser.set
-remove_option = _parser.remove_option
+set = _changes(_parser.set)
+remove_option = _changes(_parser.remove_option)
 
+@_cached
 def getescaped(section, option):
     return get(section, option).decode('string-escape')
 
-def getlist(section, option):
+@_cached
+def gettemplate(section, option):
+    """getescaped as a L{Template}"""
+    return Template(getescaped(section, option))
+
+@_cached
+def _getlist(section, option):
     o = []
     if _parser.has_option(section, option+'[]'):
         count = _parser.getint(section, option+'[]')
@@ -100,7 +148,7 @@ def getlist(section, option):
             o = []
 
     try:
-        plus = getlist(section, option+'+')
+        plus = _getlist(section, option+'+')
         for item in plus:
             if item not in o:
                 o.append(item)
@@ -108,22 +156,29 @@ def getlist(section, option):
         pass
 
     try:
-        minus = getlist(section, option+'-')
+        minus = _getlist(section, option+'-')
         for item in minus:
             if item in o:
                 o.remove(item)
     except (NoSectionError, NoOptionError):
         pass
 
-    return o
+    return tuple(o)
+
+def getlist(section, option):
+    return list(_getlist(section, option))
+
+@_cached
+def _getdict(section, option):
+    return tuple(
+        tuple(i.split(':', 1))
+        for i in _getlist(section,option)
+        )
 
 def getdict(section, option):
-    return dict((
-        i.split(':', 1)
-        for i in getlist(section,option)
-        ))
+    return dict(_getdict(section, option))
 
+@_cached
 def getduration(section, option):
     s = _parser.get(section, option)
     return timediff_from_str(s)
-
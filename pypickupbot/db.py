@@ -20,25 +20,180 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
-"""Persistent data access."""
+"""Persistent data access.
+
+Writes go through a single connection, so that they are serialized by the
+pool instead of fighting over the database lock. They are also queued for a
+short while and committed together, see L{WriteQueue}. When the database is
+in WAL mode, queries run on separate reader connections alongside them."""
 
 import os.path
 
 from twisted.enterprise import adbapi
+from twisted.internet import defer, reactor
+from twisted.python import log
+
+from pypickupbot import config
+
+def _pragmas():
+    """PRAGMA statements run on each new connection, from the [Database]
+    config section"""
+    pragmas = [
+        ('journal_mode', config.get('Database', 'journal mode')),
+        ('synchronous', config.get('Database', 'synchronous')),
+        ('cache_size', config.get('Database', 'cache size')),
+        ('mmap_size', config.get('Database', 'mmap size')),
+        ]
+    return ["PRAGMA {0}={1}".format(name, value)
+        for name, value in pragmas if value != '']
+
+def _setup_connection(connection):
+    cursor = connection.cursor()
+    for pragma in _pragmas():
+        cursor.execute(pragma)
+        cursor.fetchall()
+    cursor.close()
+
+class WriteQueue:
+    """Runs operations and interactions in as few transactions as possible.
+
+    Writes are held for up to L{window} seconds, or until L{max_batch} of
+    them are waiting, then run one after the other in a single transaction.
+    Each write's deferred still fires with its own result. Should the
+    transaction fail, its writes are retried one transaction each, so that
+    only the faulty ones fail; interactions should thus not have side
+    effects outside of the database before their last statement.
+
+    Statements committing on their own, like DDL and some PRAGMAs, would
+    commit the writes batched before them and get those retried twice;
+    they go through L{runUnbatched} instead.
+    """
+
+    def __init__(self, pool, window, max_batch):
+        self.pool = pool
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = [] # (function, args, kwargs, deferred)
+        self.timer = None
+        self.running = [] # deferreds of what was sent to the pool
+        self.batches = 0
+        self.writes = 0
+
+    def runOperation(self, *args, **kwargs):
+        return self.runInteraction(_execute, *args, **kwargs)
+
+    def runInteraction(self, interaction, *args, **kwargs):
+        d = defer.Deferred()
+        self.queue.append((interaction, args, kwargs, d))
+        if len(self.queue) >= self.max_batch or self.window <= 0:
+            self.flush()
+        elif self.timer == None:
+            self.timer = reactor.callLater(self.window, self.flush)
+        return d
+
+    def flush(self):
+        """Sends queued writes to the database now
+
+        @returns: a deferred fired once everything written so far is
+            committed"""
+        if self.timer != None:
+            if self.timer.active():
+                self.timer.cancel()
+            self.timer = None
+        if self.queue:
+            batch, self.queue = self.queue, []
+            self.batches += 1
+            self.writes += len(batch)
+            d = self.pool.runInteraction(_run_batch, batch)
+            d.addCallbacks(self._committed, self._failed,
+                callbackArgs=(batch,), errbackArgs=(batch,))
+            self._track(d)
+        return self.flushed()
+
+    def runUnbatched(self, interaction, *args, **kwargs):
+        """Runs interaction in a transaction of its own, after the writes
+        queued so far"""
+        self.flush()
+        return self._track(
+            self.pool.runInteraction(interaction, *args, **kwargs))
+
+    def _track(self, d):
+        """Makes L{flushed} wait on d"""
+        self.running.append(d)
+        def _done(result):
+            self.running.remove(d)
+            return result
+        return d.addBoth(_done)
+
+    def flushed(self):
+        """@returns: a deferred fired once writes sent so far are committed,
+        including the retries of failed batches"""
+        if self.queue:
+            return self.flush()
+        if not self.running:
+            return defer.succeed(None)
+        return defer.DeferredList(self.running[:]).addCallback(
+            lambda results: None)
+
+    def _committed(self, results, batch):
+        for (interaction, args, kwargs, d), result in zip(batch, results):
+            d.callback(result)
+
+    def _failed(self, failure, batch):
+        if len(batch) == 1:
+            batch[0][3].errback(failure)
+            return
+        log.msg("Batch of {0} writes failed ({1}), retrying them one by one"
+            .format(len(batch), failure.getErrorMessage()))
+        retries = []
+        for interaction, args, kwargs, d in batch:
+            retry = self.pool.runInteraction(interaction, *args, **kwargs)
+            retry.chainDeferred(d)
+            retries.append(retry)
+        # the batch is only done once they are
+        return defer.DeferredList(retries)
+
+def _execute(txn, *args, **kwargs):
+    txn.execute(*args, **kwargs)
+
+def _run_batch(txn, batch):
+    return [interaction(txn, *args, **kwargs)
+        for interaction, args, kwargs, d in batch]
 
 class DBs:
     db = None
+    readers = None
+    writes = None
 
     @classmethod
     def load_db(cls, configdir=None, dbfile=None):
-        if dbfile != None:
-            cls.db = adbapi.ConnectionPool("sqlite3", dbfile, check_same_thread=False)
-        else:
+        if dbfile == None:
             if configdir != None:
-                cls.db = adbapi.ConnectionPool("sqlite3",
-                    os.path.join(configdir, "db.sqlite"), check_same_thread=False)
+                dbfile = os.path.join(configdir, "db.sqlite")
             else:
-                cls.db = adbapi.ConnectionPool("sqlite3", "db.sqlite", check_same_thread=False)
+                dbfile = "db.sqlite"
+
+        options = dict(
+            check_same_thread=False,
+            timeout=config.getfloat('Database', 'busy timeout'),
+            cp_openfun=_setup_connection,
+            )
+        cls.db = adbapi.ConnectionPool("sqlite3", dbfile,
+            cp_min=1, cp_max=1, **options)
+
+        readers = config.getint('Database', 'readers')
+        if readers > 0 and config.get('Database', 'journal mode').lower() == 'wal':
+            cls.readers = adbapi.ConnectionPool("sqlite3", dbfile,
+                cp_min=1, cp_max=readers, **options)
+        else:
+            # without WAL readers would only wait on the writer
+            cls.readers = cls.db
+        log.msg("Database {0}: {1}".format(dbfile, ', '.join(_pragmas())))
+
+        cls.writes = WriteQueue(cls.db,
+            config.getfloat('Database', 'write window'),
+            config.getint('Database', 'write batch'))
+        reactor.addSystemEventTrigger('before', 'shutdown', cls.writes.flush)
 
         cls._db_postload()
     
@@ -54,12 +209,60 @@ class DBs:
             """)
     
 
+def migrate(name, migrations):
+    """Brings a module's tables up to date
+
+    The version of each schema is kept in the meta table, under
+    "schema:<name>". As DDL statements commit on their own, migrations
+    should be safe to run again if one fails half way.
+
+    @param name: name of the schema, usually the module's
+    @param migrations: list whose n-th item upgrades the schema to version
+        n+1: an SQL statement, a list of them or a callable taking a cursor
+    @returns: a deferred fired with the schema's version"""
+    key = "schema:" + name
+
+    def _migrate(txn):
+        txn.execute("SELECT val FROM meta WHERE key=?", (key,))
+        row = txn.fetchone()
+        version = int(row[0]) if row else 0
+        if version > len(migrations):
+            log.msg("Schema {0} is at version {1}, newer than this version "
+                "of pypickupbot knows about ({2})".format(
+                    name, version, len(migrations)))
+            return version
+        for migration in migrations[version:]:
+            if callable(migration):
+                migration(txn)
+            elif isinstance(migration, basestring):
+                txn.execute(migration)
+            else:
+                for statement in migration:
+                    txn.execute(statement)
+            version += 1
+            txn.execute("""
+                INSERT OR REPLACE INTO meta(key, val)
+                VALUES(?, ?)
+                """, (key, str(version)))
+            log.msg("Migrated schema {0} to version {1}".format(name, version))
+        return version
+
+    d = runUnbatched(_migrate)
+    d.addErrback(log.err, "migrating schema {0}".format(name))
+    return d
+
 def runInteraction(*args, **kwargs):
-    return DBs.db.runInteraction(*args, **kwargs)
+    return DBs.writes.runInteraction(*args, **kwargs)
+
+def runUnbatched(*args, **kwargs):
+    """For interactions with statements that commit by themselves, see
+    L{WriteQueue.runUnbatched}"""
+    return DBs.writes.runUnbatched(*args, **kwargs)
 
 def runQuery(*args, **kwargs):
-    return DBs.db.runQuery(*args, **kwargs)
+    """Runs a query once the writes issued before it are committed"""
+    return DBs.writes.flushed().addCallback(
+        lambda _: DBs.readers.runQuery(*args, **kwargs))
 
 def runOperation(*args, **kwargs):
-    return DBs.db.runOperation(*args, **kwargs)
-
+    return DBs.writes.runOperation(*args, **kwargs)
@@ -0,0 +1,114 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""event dispatching"""
+
+from twisted.internet import defer
+from twisted.python import log
+
+class EventBus:
+    """Calls the handlers subscribed to events
+
+    Handlers with a higher priority are called first, those with the same
+    priority in the order they subscribed. The sorted handlers of each
+    event are only worked out again when subscriptions change."""
+
+    def __init__(self):
+        self.handlers = {}  # event : [(priority, n, handler)]
+        self.chains = {}    # event : handlers in calling order
+        self.n = 0
+
+    def __contains__(self, event):
+        return event in self.handlers
+
+    def subscribe(self, event, handler, priority=0):
+        # negated so that sorting puts higher priorities first
+        self.handlers.setdefault(event, []).append(
+            (-priority, self.n, handler))
+        self.n += 1
+        self.chains.pop(event, None)
+
+    def unsubscribe(self, event, handler):
+        """Removes every subscription of handler to event"""
+        handlers = [entry for entry in self.handlers.get(event, [])
+            if entry[2] != handler]
+        if handlers:
+            self.handlers[event] = handlers
+        else:
+            self.handlers.pop(event, None)
+        self.chains.pop(event, None)
+
+    def chain(self, event):
+        """@returns: the handlers of event, in calling order"""
+        try:
+            return self.chains[event]
+        except KeyError:
+            chain = self.chains[event] = tuple(handler
+                for priority, n, handler in sorted(self.handlers.get(event, [])))
+            return chain
+
+    def _call(self, event, handler, args, kwargs):
+        """Calls handler, logging what it raises
+
+        @returns: what the handler returned, or None if it raised"""
+        try:
+            return handler(*args, **kwargs)
+        except Exception:
+            log.err(None, "handling event %s" % event)
+
+    def notify(self, event, *args, **kwargs):
+        """Calls event's handlers without waiting on them or collecting
+        what they return. Errors of handlers returning deferreds are
+        logged."""
+        if event not in self.handlers:
+            return
+        for handler in self.chain(event):
+            r = self._call(event, handler, args, kwargs)
+            if isinstance(r, defer.Deferred):
+                r.addErrback(log.err, "handling event %s" % event)
+
+    def fire(self, event, *args, **kwargs):
+        """Calls event's handlers
+
+        @param fire_event_func: function turning the list of what each
+            handler returned into the deferred's result, all() by default.
+            A handler that failed counts as returning None.
+        @returns: a deferred fired once all handlers are done"""
+        func = kwargs.pop('fire_event_func', all)
+        if event not in self.handlers:
+            return defer.succeed(func([]))
+
+        results = [self._call(event, handler, args, kwargs)
+            for handler in self.chain(event)]
+        deferreds = [r for r in results if isinstance(r, defer.Deferred)]
+        if not deferreds:
+            return defer.succeed(func(results))
+
+        def _failed(failure):
+            log.err(failure, "handling event %s" % event)
+        for d in deferreds:
+            d.addErrback(_failed)
+        def _gotResults(l):
+            results_ = iter(zip(*l)[1])
+            return func([results_.next() if isinstance(r, defer.Deferred)
+                else r for r in results])
+        return defer.DeferredList(deferreds).addCallback(_gotResults)
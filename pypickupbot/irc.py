@@ -23,6 +23,8 @@
 
 import re
 from time import time
+from itertools import groupby
+from operator import itemgetter
 
 from twisted.internet import protocol, defer
 from twisted.words.protocols import irc
@@ -35,7 +37,9 @@ from pypickupbot import i18n
 from pypickupbot import config
 from pypickupbot.modable import Modable
 from pypickupbot.topic import Topic
-from pypickupbot.misc import itime
+from pypickupbot.sendqueue import SendQueue
+from pypickupbot.events import EventBus
+from pypickupbot.misc import itime, irc_lower
 
 class COMMAND:
     def __init__(self): raise NotImplementedError
@@ -48,19 +52,53 @@ class COMMAND:
 class InputError(Exception):
     pass
 
+_tag_escapes = {':': ';', 's': ' ', 'r': '\r', 'n': '\n', '\\': '\\'}
+
+def parse_tags(s):
+    """Turns the IRCv3 message tags of a line, without the leading @, into
+    a dict. Tags without a value are set to True."""
+    tags = {}
+    for tag in s.split(';'):
+        if not tag:
+            continue
+        key, eq, value = tag.partition('=')
+        if not eq:
+            tags[key] = True
+            continue
+        unescaped = []
+        chars = iter(value)
+        for c in chars:
+            if c == '\\':
+                c = next(chars, '')
+                c = _tag_escapes.get(c, c)
+            unescaped.append(c)
+        tags[key] = ''.join(unescaped)
+    return tags
+
 class IrcBot(irc.IRCClient, Modable):
     """The bot itself.
     
     @ivar commands: the bot's commands
     @type commands: {'command_name': ( func(L{LineProcessor}, list(args)), flags ) }
+    @ivar eventhandlers: the bot's events, modules subscribe to them with
+        {'event': handler or (handler, priority)}
+    @type eventhandlers: L{EventBus}
+    @ivar contexts: the channels the bot joined
+    @type contexts: {irc_lower(channel): L{Channel}}
+    @ivar capabilities: IRCv3 capabilities the server enabled
+    @ivar tags: IRCv3 message tags of the line being handled
+    @ivar accounts: services accounts of users, as the server reports them
+        with the account-notify, extended-join and account-tag capabilities
+    @type accounts: {irc_lower(nick): account}
     """
     modable_name = 'pypickupbot'
     _extend = {
         'commands': Modable.EXTEND_DICT,
-        'eventhandlers': Modable.EXTEND_DICT_LIST
+        'eventhandlers': Modable.EXTEND_EVENTS
         }
 
-    lineRate = 1
+    # throttled by self.sendqueue instead
+    lineRate = None
 
     def _get_nickname(self):
         return self.factory.nickname
@@ -69,17 +107,28 @@ class IrcBot(irc.IRCClient, Modable):
     def __init__(self):
         self.modules = {}
         self.commands = {}
-        self.eventhandlers = {
-            'privmsg': [self.privmsg_],
-            'joined': [self.joined_],
-            'joinedHomeChannel':  [self.joinedHomeChannel],
-            'irc_JOIN': [self.irc_JOIN_],
-            'irc_PART': [self.irc_PART_],
-            'irc_QUIT': [self.irc_QUIT_],
-            'irc_KICK': [self.irc_KICK_],
-            'irc_RPL_WELCOME': [self.welcome_],
-        }
+        self.eventhandlers = EventBus()
+        for event, handler in [
+                ('privmsg', self.privmsg_),
+                ('joined', self.joined_),
+                ('joinedHomeChannel', self.joinedHomeChannel),
+                ('irc_JOIN', self.irc_JOIN_),
+                ('irc_PART', self.irc_PART_),
+                ('irc_QUIT', self.irc_QUIT_),
+                ('irc_KICK', self.irc_KICK_),
+                ('irc_CAP', self.irc_CAP_),
+                ('irc_ACCOUNT', self.irc_ACCOUNT_),
+                ('irc_AWAY', self.irc_AWAY_),
+                ('userRenamed', self.userRenamed_),
+                ('irc_RPL_WELCOME', self.welcome_),
+                ]:
+            self.eventhandlers.subscribe(event, handler)
         self.fetching_lists={}
+        self.contexts = {}
+        self.capabilities = set()
+        self.offered_capabilities = []
+        self.tags = {}
+        self.accounts = {}
         self.channel = None
         self.setTopic = self.topic
         self.topic = None
@@ -97,6 +146,68 @@ class IrcBot(irc.IRCClient, Modable):
             self.realname = None
 
         self.channelpws = config.getdict('Server', 'channel passwords')
+        self.dispatcher = CommandDispatcher(self)
+        config.listeners.append(self.dispatcher.rebuild)
+
+        self.sendqueue = SendQueue(self._reallySendLine,
+            config.getint('Server', 'flood burst'),
+            config.getfloat('Server', 'flood rate'),
+            self._max_targets)
+        self._lane = SendQueue.NORMAL
+
+        self.batch_delay = config.getfloat('Server', 'batch delay')
+        self.batched = []
+        self.batch_call = None
+
+    def connectionLost(self, reason):
+        config.listeners.remove(self.dispatcher.rebuild)
+        self.sendqueue.clear()
+        if self.batch_call != None and self.batch_call.active():
+            self.batch_call.cancel()
+        self.batch_call = None
+        self.batched = []
+        irc.IRCClient.connectionLost(self, reason)
+
+    def sendLine(self, line):
+        self.sendqueue.put(line, self._lane)
+
+    def register(self, nickname, hostname='foo', servername='bar'):
+        """Asks for the server's capabilities before registering. Servers
+        with them wait until CAP END, others ignore the request."""
+        self.capabilities = set()
+        self.offered_capabilities = []
+        if config.getlist('Server', 'capabilities'):
+            self.sendLine('CAP LS 302')
+        irc.IRCClient.register(self, nickname, hostname, servername)
+
+    def lineReceived(self, line):
+        if line[:1] == '@':
+            tags, line = line[1:].split(' ', 1)
+            self.tags = parse_tags(tags)
+            if 'account' in self.tags and line[:1] == ':':
+                nick = line[1:].split(' ', 1)[0].split('!')[0]
+                self._set_account(nick, self.tags['account'])
+        else:
+            self.tags = {}
+        irc.IRCClient.lineReceived(self, line)
+
+    def msg_many(self, users, message):
+        """Sends the same message to several users, after other lines
+        waiting to be sent and in as few lines as the server allows"""
+        self._lane = SendQueue.BULK
+        try:
+            for user in users:
+                self.msg(user, message)
+        finally:
+            self._lane = SendQueue.NORMAL
+
+    def _max_targets(self, command):
+        """How many targets the server allows command to have, None if it
+        doesn't limit them"""
+        targmax = self.supported.getFeature('TARGMAX')
+        if not targmax:
+            return 1
+        return targmax.get(command, 1)
 
     def signedOn(self):
         """called when the bot connects: joins channels"""
@@ -122,39 +233,168 @@ class IrcBot(irc.IRCClient, Modable):
             self.join(channel, key)
 
     def joinedHomeChannel(self):
-        self.topic = Topic(self)
+        self.topic = self.get_context(self.channel).topic
 
     def joined_(self, channel):
-        FetchedList.get_users(self, channel).get()
+        users = FetchedList.get_users(self, channel)
+        if users.cmd.startswith('NAMES'):
+            # servers send it by themselves on joins
+            users.expect()
+        else:
+            users.get()
         self.prompts[channel] = {}
+        # modules add their parts of the topic anew on every join
+        old = self.contexts.get(irc_lower(channel))
+        if old != None:
+            old.topic.cancel()
+        context = self.contexts[irc_lower(channel)] = Channel(self, channel)
+        self.fire('joinedChannel', context)
         if channel == self.channel:
             self.fire('joinedHomeChannel')
 
+    def get_context(self, channel):
+        """@returns: the L{Channel} of a channel the bot joined, None if it
+        didn't"""
+        return self.contexts.get(irc_lower(channel))
+
     def privmsg_(self, user, channel, message):
         """when we receive a message"""
+        line = self.dispatcher.match(channel, message)
+        if line == None:
+            return
         log.callWithContext(
             {'system': user},
-            LineProcessor, self, user, channel, message)
+            LineProcessor, self, user, channel, message, line)
+
+    # joins and quits come in floods on netsplits, these are batched
+    batched_commands = ('JOIN', 'QUIT')
+    batch_events = {
+        'userJoined': 'usersJoined',
+        'userQuit': 'usersQuit',
+        }
+
+    def handleCommand(self, command, prefix, params):
+        if self.batched and command not in self.batched_commands:
+            self.flush_batch()
+        irc.IRCClient.handleCommand(self, command, prefix, params)
+
+    def batch(self, event, *args):
+        """Notifies of event along with the others of its kind received
+        until another line comes in or batch delay passes"""
+        self.batched.append((event, args))
+        if self.batch_call == None:
+            self.batch_call = reactor.callLater(
+                self.batch_delay, self.flush_batch)
+
+    def flush_batch(self):
+        """Notifies of batched events: each run of events of the same kind
+        as one usersJoined or usersQuit event with the list of their
+        arguments, then one by one"""
+        if self.batch_call != None and self.batch_call.active():
+            self.batch_call.cancel()
+        self.batch_call = None
+        batched, self.batched = self.batched, []
+        for event, run in groupby(batched, itemgetter(0)):
+            args = [args for event_, args in run]
+            self.notify(self.batch_events[event], args)
+            for args_ in args:
+                self.notify(event, *args_)
+
+    def irc_CAP_(self, prefix, params):
+        subcommand = params[1]
+        caps = params[-1].split()
+        if subcommand == 'LS':
+            # values come after =, a * before the list means more lines
+            self.offered_capabilities.extend(
+                cap.split('=', 1)[0] for cap in caps)
+            if params[2] == '*' and len(params) > 3:
+                return
+            self._request_capabilities(self.offered_capabilities)
+        elif subcommand == 'NEW':
+            self._request_capabilities(
+                [cap.split('=', 1)[0] for cap in caps])
+        elif subcommand == 'ACK':
+            for cap in caps:
+                if cap[:1] == '-':
+                    self.capabilities.discard(cap[1:])
+                else:
+                    self.capabilities.add(cap)
+            log.msg(_("Enabled capabilities: {0}").format(
+                ' '.join(sorted(self.capabilities))))
+            self._end_capabilities()
+        elif subcommand == 'NAK':
+            self._end_capabilities()
+        elif subcommand == 'DEL':
+            self.capabilities.difference_update(caps)
+
+    def _request_capabilities(self, offered):
+        wanted = [cap for cap in config.getlist('Server', 'capabilities')
+            if cap in offered and cap not in self.capabilities]
+        if wanted:
+            self.sendLine('CAP REQ :%s' % ' '.join(wanted))
+        else:
+            self._end_capabilities()
+
+    def _end_capabilities(self):
+        if not self._registered:
+            self.sendLine('CAP END')
+
+    def account(self, nick):
+        """@returns: the services account nick is logged in as, None if
+        they aren't or if it isn't known"""
+        return self.accounts.get(irc_lower(nick))
+
+    def _set_account(self, nick, account):
+        """@param account: as the server gives it, * when logged out"""
+        if account == '*':
+            account = None
+        key = irc_lower(nick)
+        if self.accounts.get(key) == account:
+            return
+        if account == None:
+            del self.accounts[key]
+        else:
+            self.accounts[key] = account
+        self.notify('accountChanged', nick, account)
+
+    def irc_ACCOUNT_(self, prefix, params):
+        self._set_account(prefix.split('!')[0], params[0])
+
+    def irc_AWAY_(self, prefix, params):
+        if params:
+            self.notify('userAway', prefix, params[-1])
+        else:
+            self.notify('userBack', prefix)
+
+    def userRenamed_(self, oldname, newname):
+        account = self.accounts.pop(irc_lower(oldname), None)
+        if account != None:
+            self.accounts[irc_lower(newname)] = account
 
     def irc_JOIN_(self, prefix, params):
         nick = prefix.split('!')[0]
-        channel = params[-1]
+        # extended-join adds the account and real name after the channel
+        channel = params[0]
+        if 'extended-join' in self.capabilities and len(params) > 1:
+            self._set_account(nick, params[1])
         if nick == self.nickname:
-            self.fire('joined', channel)
+            self.flush_batch()
+            self.notify('joined', channel)
         else:
-            self.fire('userJoined', prefix, channel)
+            self.batch('userJoined', prefix, channel)
 
     def irc_PART_(self, prefix, params):
         nick = prefix.split('!')[0]
         channel = params[-1]
         if nick == self.nickname:
-            self.fire('left', channel)
+            self.notify('left', channel)
         else:
-            self.fire('userLeft', prefix, channel)
+            self.notify('userLeft', prefix, channel)
 
     def irc_QUIT_(self, prefix, params):
         message = params[-1]
-        self.fire('userQuit', prefix, message)
+        self.accounts.pop(irc_lower(prefix.split('!')[0]), None)
+        self.batch('userQuit', prefix, message)
 
     def irc_KICK_(self, prefix, params):
         kicker = prefix
@@ -163,38 +403,34 @@ class IrcBot(irc.IRCClient, Modable):
         message = params[-1]
 
         if kicked == self.nickname:
-            self.fire('kickedFrom', channel, kicker, message)
+            self.notify('kickedFrom', channel, kicker, message)
         else:
             d = FetchedList.get_users(self, channel).get()
             def _fireEvent(userlist):
-                for nick, ident, host, flags in userlist:
-                    if nick == kicked:
-                        self.fire('userKicked', 
-                            '%s!%s@%s' % (nick, ident, host),
-                            channel, kicker, message)
+                user = userlist.get(kicked)
+                if user:
+                    nick, ident, host, flags = user
+                    self.fire('userKicked', 
+                        '%s!%s@%s' % (nick, ident, host),
+                        channel, kicker, message)
             d.addCallback(_fireEvent)
 
     def fire(self, event, *args, **kwargs):
-        func = kwargs.pop('fire_event_func', all)
+        """Calls event's handlers, see L{EventBus.fire}
+
+        @returns: a deferred fired once all handlers are done"""
         if config.debug:
             log.msg("Event %s fired with args %s, kwargs %s" % (event, args, kwargs))
+        return self.eventhandlers.fire(event, *args, **kwargs)
 
-        dl = []
-
-        if event in self.eventhandlers:
-            for callback in self.eventhandlers[event]:
-                dl.append(defer.maybeDeferred(callback, *args, **kwargs))
-
-        d = defer.DeferredList(dl)
-
-        def _gotResults(l):
-            if l:
-                l_ = zip(*l)[1]
-            else:
-                l_ = []
-            return func(l_)
-
-        return d.addCallback(_gotResults)
+    def notify(self, event, *args, **kwargs):
+        """Calls event's handlers without waiting on them, for when nothing
+        depends on them being done"""
+        if event not in self.eventhandlers:
+            return
+        if config.debug:
+            log.msg("Event %s fired with args %s, kwargs %s" % (event, args, kwargs))
+        self.eventhandlers.notify(event, *args, **kwargs)
 
     def is_admin(self, user, nick):
         return self.fire('is_admin', user, nick, fire_event_func=any)
@@ -211,6 +447,24 @@ class IrcBot(irc.IRCClient, Modable):
         """shorthand for sending channel messages"""
         return self.msg(self.channel, message)
 
+    def parse_names(self, entry):
+        """Reads an entry of a NAMES reply
+
+        With multi-prefix, every prefix of the user is there, and with
+        userhost-in-names, their ident and host.
+
+        @returns: (nick, ident, host, modes), ident and host being empty
+            when not given"""
+        prefixes = dict((symbol, mode) for mode, (symbol, priority)
+            in self.supported.getFeature('PREFIX', {}).iteritems())
+        modes = []
+        while entry[:1] in prefixes:
+            modes.append(prefixes[entry[0]])
+            entry = entry[1:]
+        nick, sep, userhost = entry.partition('!')
+        ident, sep, host = userhost.partition('@')
+        return nick, ident, host, modes
+
     def fetch_list(self, cmd, *args, **kwargs):
         if cmd not in self.fetching_lists:
             self.fetching_lists[cmd] = \
@@ -223,6 +477,7 @@ class IrcBot(irc.IRCClient, Modable):
         'kickedFrom', 'nickChanged', 'action', 'topicUpdated', 'userRenamed',
         'receivedMOTD',
         'irc_JOIN', 'irc_KICK', 'irc_PART', 'irc_QUIT',
+        'irc_CAP', 'irc_ACCOUNT', 'irc_AWAY',
         'irc_RPL_WHOREPLY', 'irc_RPL_ENDOFWHO',
         'irc_unknown', 'irc_RPL_NAMREPLY', 'irc_RPL_ENDOFNAMES',
         'irc_RPL_BANLIST', 'irc_RPL_ENDOFBANLIST',
@@ -231,7 +486,7 @@ class IrcBot(irc.IRCClient, Modable):
     def do_import_events(cls):
         def make_func(eventname):
             def func(self, *args, **kwargs):
-                self.fire(eventname, *args, **kwargs)
+                self.notify(eventname, *args, **kwargs)
             return func
         for evt in cls.import_events:
             setattr(cls, evt, make_func(evt))
@@ -262,8 +517,12 @@ class FetchedList:
             check_line=lambda prefix, x, contents: [x],
             check_end=lambda prefix, x, contents: True,
             check_update=lambda prefix, x, contents: [x],
-            check_other=lambda name, prefix, x, contents: ([x], [])
+            check_other=lambda name, prefix, x, contents: ([x], []),
+            contents=list
             ):
+        """
+        @param contents: makes the container of fetched items, with extend
+            and remove methods like a list's"""
         if other == None:
             other = []
 
@@ -277,6 +536,7 @@ class FetchedList:
         self.check_end = check_end
         self.check_update = check_update
         self.check_other = check_other
+        self.make_contents = contents
 
         self.fetching = False
         self.contents = None
@@ -293,9 +553,7 @@ class FetchedList:
                 ]:
             if not event:
                 continue
-            if event not in bot.eventhandlers:
-                bot.eventhandlers[event] = []
-            bot.eventhandlers[event].append(func)
+            bot.eventhandlers.subscribe(event, func)
 
     def get(self, refresh=False):
         if not self.fetching and (refresh or self.contents == None):
@@ -313,15 +571,23 @@ class FetchedList:
         self.deferred.addCallback(_cb)
         return d
 
-    def _refetch(self):
+    def _refetch(self, send=True):
         self.fetching = True
-        self.contents = []
+        self.contents = self.make_contents()
         self.deferred = defer.Deferred()
 
-        self.bot.sendLine(self.cmd)
+        if send:
+            self.bot.sendLine(self.cmd)
 
         return self._give_current_deferred()
 
+    def expect(self):
+        """Reads the list from a reply the server sends without being
+        asked, like NAMES on joins"""
+        if self.fetching:
+            return self._give_current_deferred()
+        return self._refetch(send=False)
+
     def _line(self, *args):
         if not self.fetching:
             return
@@ -359,9 +625,9 @@ class FetchedList:
 
         add, remove = r
 
-        self.contents.extend(add)
         for to_remove in remove:
             self.contents.remove(to_remove)
+        self.contents.extend(add)
 
         if add or remove:
             self._fire_update()
@@ -378,16 +644,17 @@ class FetchedList:
         if not r:
             return
         add, remove = r
+        if not (add or remove):
+            return
 
-
-        self.contents.extend(add)
         for to_remove in remove:
             self.contents.remove(to_remove)
+        self.contents.extend(add)
 
         self._fire_update()
 
     def _fire_update(self):
-        self.bot.fire('FetchedList %s updated' % self.cmd)
+        self.bot.notify('FetchedList %s updated' % self.cmd)
 
     @classmethod
     def get_users(cls, bot, channel):
@@ -412,39 +679,59 @@ class FetchedList:
             if channel_.lower() == channel.lower():
                 return True
 
+        def _check_names(args, contents):
+            me, type_, channel_, names = tuple(args[1])
+            if channel_.lower() == channel.lower():
+                return [bot.parse_names(entry) for entry in names.split()]
+
         def _check_other(event, args, contents):
             if event == 'modeChanged':
                 author, channel_, set, modes, args = args
 
-                if channel_ != channel:
+                if irc_lower(channel_) != irc_lower(channel):
                     return
 
                 for mode, arg in zip(modes, args):
                     if mode in 'ov':
-                        for nick, ident, host, flags in contents:
-                            if nick == arg:
-                                flags_ = flags[:]
-                                if set:
-                                    flags_.append(mode)
-                                else:
-                                    if mode in flags:
-                                        flags_.remove(mode)
-                                return (
-                                        [(nick, ident, host, flags_)],
-                                        [(nick, ident, host, flags)]
-                                    )
+                        user = contents.get(arg)
+                        if user:
+                            nick, ident, host, flags = user
+                            flags_ = flags[:]
+                            if set:
+                                flags_.append(mode)
+                            else:
+                                if mode in flags:
+                                    flags_.remove(mode)
+                            return (
+                                    [(nick, ident, host, flags_)],
+                                    [user]
+                                )
 
             elif event == 'userRenamed':
                 oldnick, newnick = args
 
-                for nick, ident, host, flags in contents:
-                    if nick == oldnick:
-                        return (
-                                [(newnick, ident, host, flags)],
-                                [(oldnick, ident, host, flags)]
-                            )
-
-            elif event in ('userLeft', 'userKicked', 'userQuit', 'userJoined'):
+                user = contents.get(oldnick)
+                if user:
+                    nick, ident, host, flags = user
+                    return (
+                            [(newnick, ident, host, flags)],
+                            [user]
+                        )
+
+            elif event == 'usersJoined':
+                users, = args
+                return ([(prefix.split('!')[0],
+                        prefix.split('!')[1].split('@')[0],
+                        prefix.split('@')[1], [])
+                    for prefix, channel_ in users
+                    if irc_lower(channel_) == irc_lower(channel)], [])
+
+            elif event == 'usersQuit':
+                users, = args
+                return ([], filter(None, [contents.get(prefix.split('!')[0])
+                    for prefix, message in users]))
+
+            elif event in ('userLeft', 'userKicked'):
                 user = args[0]
 
                 channel_ = args[1]
@@ -453,23 +740,32 @@ class FetchedList:
                 ident = user.split('!')[1].split('@')[0]
                 host = user.split('@')[1]
 
-                if event != 'userQuit' and channel_ != channel:
+                if irc_lower(channel_) != irc_lower(channel):
                     return
 
-                if event == 'userJoined':
-                    return ([(nick, ident, host, [])], [])
-                else:
-                    for nick_, ident_, host_, flags in contents:
-                        if nick_ == nick:
-                            return ([], [(nick, ident, host, flags)])
+                user = contents.get(nick)
+                if user:
+                    return ([], [user])
+
+        other = ['usersJoined', 'userLeft', 'userKicked',
+            'usersQuit', 'userRenamed', 'modeChanged']
+
+        # NAMES replies, much shorter than WHO's, only have everything
+        # needed with these
+        if bot.capabilities.issuperset(['multi-prefix', 'userhost-in-names']):
+            return bot.fetch_list(
+                cmd='NAMES %s' % channel,
+                line='irc_RPL_NAMREPLY', check_line=_check_names,
+                end='irc_RPL_ENDOFNAMES', check_end=_check_end,
+                other=other, check_other=_check_other,
+                contents=ChannelRoster)
 
         return bot.fetch_list(
             cmd='WHO %s' % channel,
             line='irc_RPL_WHOREPLY', check_line=_check_line,
             end='irc_RPL_ENDOFWHO', check_end=_check_end,
-            other=['userJoined', 'userLeft', 'userKicked',
-                'userQuit', 'userRenamed', 'modeChanged'],
-            check_other=_check_other)
+            other=other, check_other=_check_other,
+            contents=ChannelRoster)
 
     @classmethod
     def get_bans(cls, bot, channel):
@@ -530,12 +826,9 @@ class FetchedList:
         nick = user.split('!')[0]
 
         def _gotList(l):
-            for nick_, ident, host, flags in l:
-                if nick_ == nick:
-                    if flag in flags:
-                        return True
-                    else:
-                        return False
+            user = l.get(nick)
+            if user:
+                return flag in user[3]
 
         return cls.get_users(bot, channel).get().addCallback(_gotList)
 
@@ -543,38 +836,154 @@ class FetchedList:
     def bot_has_op(cls, bot):
         return cls.has_flag(bot, bot.channel, bot.nickname, 'o')
 
+class Channel:
+    """A channel the bot joined and what the bot keeps about it
+
+    @ivar topic: the channel's topic, which modules add their parts to
+    @type topic: L{Topic}"""
+
+    def __init__(self, bot, name):
+        self.bot = bot
+        self.name = name
+        self.topic = Topic(bot, name)
+
+    def msg(self, message):
+        return self.bot.msg(self.name, message)
+
+    def notice(self, message):
+        return self.bot.notice(self.name, message)
+
+class CommandDispatcher:
+    """Tells commands apart from chat
+
+    The command prefix, mention pattern and related settings are read once,
+    as most channel messages aren't for the bot and should be dismissed
+    quickly. The bot has L{rebuild} called when settings change, the
+    mention pattern is rebuilt by itself when the bot's nickname changes."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.rebuild()
+
+    def rebuild(self):
+        self.prefix = config.get('Bot', 'command prefix')
+        self.allow_mentions = config.getboolean('Bot', 'allow mentions')
+        self.warn_unknown = config.getboolean('Bot', 'warn on unknown command')
+        self._mention_for(self.bot.nickname)
+
+    def _mention_for(self, nickname):
+        self.nickname = nickname
+        self.mention = re.compile(
+            '^'+re.escape(nickname or '')+'[^A-Za-z0-9 ]\W*(.*)')
+        # the characters channel commands can start with, or None for any
+        if not self.prefix or (self.allow_mentions and not nickname):
+            self.starts = None
+        else:
+            self.starts = self.prefix[0]
+            if self.allow_mentions:
+                self.starts += nickname[0]
+
+    def match(self, channel, message):
+        """@returns: (context, command line) if the message is a command,
+        None otherwise"""
+        if channel[:1] == '#':
+            if self.nickname != self.bot.nickname:
+                self._mention_for(self.bot.nickname)
+            if self.starts != None and message[:1] not in self.starts:
+                return None
+            if message.startswith(self.prefix):
+                return LineProcessor.CONTEXT_COMMAND, message[len(self.prefix):]
+            if not self.allow_mentions:
+                return None
+            m = self.mention.match(message)
+            if m:
+                return LineProcessor.CONTEXT_MENTION, m.group(1)
+        elif channel == self.bot.nickname:
+            return LineProcessor.CONTEXT_PRIVATE, message
+        return None
+
+class ChannelRoster:
+    """A channel's users, as (nick, ident, host, flags) tuples
+
+    Users are indexed by nick, compared like IRC servers do, and by host,
+    so that neither finding one nor keeping the list up to date needs to
+    go through every user."""
+
+    def __init__(self):
+        self.users = {} # irc_lower(nick) : user
+        self.hosts = {} # host.lower() : set of irc_lower(nick)
+
+    def __iter__(self):
+        return iter(self.users.values())
+
+    def __len__(self):
+        return len(self.users)
+
+    def get(self, nick, default=None):
+        return self.users.get(irc_lower(nick), default)
+
+    def add(self, user):
+        self.discard(user[0])
+        key = irc_lower(user[0])
+        self.users[key] = user
+        self.hosts.setdefault(user[2].lower(), set()).add(key)
+
+    def extend(self, users):
+        for user in users:
+            self.add(user)
+
+    def discard(self, nick):
+        user = self.users.pop(irc_lower(nick), None)
+        if user == None:
+            return
+        host = user[2].lower()
+        keys = self.hosts[host]
+        keys.discard(irc_lower(nick))
+        if not keys:
+            del self.hosts[host]
+
+    def remove(self, user):
+        self.discard(user[0])
+
+    def with_host(self, host):
+        """@returns: users connected from host"""
+        return [self.users[key] for key in self.hosts.get(host.lower(), ())]
+
+    def matching(self, masks):
+        """@returns: users that may match one of masks, those from the
+        masks' hosts when none of them has wildcards in its host"""
+        hosts = []
+        for mask in masks:
+            host = mask.rpartition('@')[2]
+            if mask.startswith('$') or '@' not in mask \
+                    or '*' in host or '?' in host:
+                return list(self)
+            hosts.append(host)
+        users = []
+        for host in set(host.lower() for host in hosts):
+            users.extend(self.with_host(host))
+        return users
+
 class LineProcessor:
     CONTEXT_PRIVATE = 0
     CONTEXT_COMMAND = 1
     CONTEXT_MENTION = 2
     CONTEXT_NORMAL = 3
-    def __init__(self, bot, user, channel, message):
+    def __init__(self, bot, user, channel, message, line):
+        """@param line: (context, command line), see
+        L{CommandDispatcher.match}"""
         self.bot = bot
         self.user = user
         self.nick = user.split('!',1)[0]
         self.channel = channel
-        command = str()
+        self.context, command = line
 
-        if channel[0]=='#':
-            if message.startswith(config.get('Bot', 'command prefix')):
-                command = message[len(config.get('Bot', 'command prefix')):]
-                self.context = self.CONTEXT_COMMAND
-            else:
-                m = re.match( '^'+re.escape(self.bot.nickname)+'[^A-Za-z0-9 ]\W*(.*)', message )
-                if m and config.getboolean('Bot', 'allow mentions'):
-                    command = m.group(1)
-                    self.context = self.CONTEXT_MENTION
-                else:
-                    # chanmsg
-                    return
-        elif channel == self.bot.nickname:
-            command = message
-            self.context = self.CONTEXT_PRIVATE
+        if self.context == self.CONTEXT_PRIVATE:
             self.channel = 'PM'
-        else:
-            return
 
         self.args = command.split()
+        if not self.args:
+            return
         self.cmd = self.args.pop(0).lower()
 
         if self.cmd in ['yes', 'no']:
@@ -588,7 +997,7 @@ class LineProcessor:
 
         if self.cmd not in self.bot.commands:
             log.msg(_("{0} attempted to use unknown command {1}.").format(self.nick, self.cmd))
-            if config.getboolean('Bot', 'warn on unknown command'):
+            if self.bot.dispatcher.warn_unknown:
                 self.reply(_("Unknown command %s.") % self.cmd)
             return
 
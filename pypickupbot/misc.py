@@ -23,6 +23,7 @@
 """various stuff that should have been in another lib"""
 
 import re
+import string
 from math import ceil
 from UserList import UserList
 from time import time
@@ -124,12 +125,10 @@ def timediff_from_str(s):
     s = list(s.lower().replace(' ', '').replace(',', ''))
 
     def _readNumber():
-        n = s[0]
-        del s[0]
-        if s[0] in '0123456789':
-            return int(n+str(_readNumber()))
-        else:
-            return int(n)
+        n = ''
+        while len(s) and s[0] in '0123456789':
+            n += s.pop(0)
+        return int(n)
 
     def _readLength():
         c = s[0]
@@ -184,6 +183,18 @@ def timediff_from_str(s):
 
     return seconds
 
+_rfc1459_lower = string.maketrans(
+    string.ascii_uppercase + '[]\\~', string.ascii_lowercase + '{}|^')
+_rfc1459_lower_unicode = dict((ord(upper), unicode(lower)) for upper, lower
+    in zip(string.ascii_uppercase + '[]\\~', string.ascii_lowercase + '{}|^'))
+
+def irc_lower(s):
+    """Lowercases a nick or channel name the way IRC servers compare them
+    (RFC1459 casemapping: []\\~ are the uppercase of {}|^)"""
+    if isinstance(s, unicode):
+        return s.translate(_rfc1459_lower_unicode)
+    return s.translate(_rfc1459_lower)
+
 irc_color = re.compile('\x03[0-9]{1,2}|\x02|\x0f')
 
 def filter_irc_colors(s):
@@ -205,6 +216,100 @@ class ListOfEverything(UserList):
             return True
         return False
 
+class SubstringIndex:
+    """Finds which keys' texts contain a string, case insensitively,
+    without going through all of them.
+
+    Every substring of up to L{gram} characters of a text is indexed, so
+    short searches are a single lookup and longer ones only check the keys
+    having all of the search's substrings of that length."""
+
+    gram = 3
+
+    def __init__(self):
+        self.texts = {}     # key : lowercase text
+        self.grams = {}     # substring : set of keys
+
+    def _grams(self, text):
+        return set(text[i:i+n]
+            for n in range(1, self.gram + 1)
+            for i in range(len(text) - n + 1))
+
+    def __contains__(self, key):
+        return key in self.texts
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, key, text):
+        """Indexes text under key, replacing what key had before"""
+        text = text.lower()
+        if self.texts.get(key) == text:
+            return
+        self.remove(key)
+        self.texts[key] = text
+        for gram in self._grams(text):
+            self.grams.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        text = self.texts.pop(key, None)
+        if text == None:
+            return
+        for gram in self._grams(text):
+            keys = self.grams[gram]
+            keys.discard(key)
+            if not keys:
+                del self.grams[gram]
+
+    def rename(self, old, new):
+        if old in self.texts:
+            self.add(new, self.texts[old])
+            self.remove(old)
+
+    def clear(self):
+        self.texts.clear()
+        self.grams.clear()
+
+    def search(self, s):
+        """@returns: set of keys whose text contains s"""
+        s = s.lower()
+        if not s:
+            return set(self.texts)
+        if len(s) <= self.gram:
+            return set(self.grams.get(s, ()))
+        postings = sorted((self.grams.get(s[i:i+self.gram], set())
+            for i in range(len(s) - self.gram + 1)), key=len)
+        keys = postings[0].intersection(*postings[1:])
+        return set(key for key in keys if s in self.texts[key])
+
+class Template:
+    """A %-style message template that knows which fields it uses, so that
+    costly values are only computed when they are shown"""
+
+    _field = re.compile(r'%\((\w+)\)')
+
+    def __init__(self, text):
+        self.text = text
+        self.fields = frozenset(self._field.findall(text))
+
+    def __contains__(self, field):
+        return field in self.fields
+
+    def __mod__(self, values):
+        return self.text % values
+
+    def render(self, values, **lazy):
+        """Fills in the template
+
+        @param lazy: functions returning the value of a field, only called
+            if the template uses it"""
+        if lazy:
+            values = dict(values)
+            for name, func in lazy.iteritems():
+                if name in self.fields:
+                    values[name] = func()
+        return self.text % values
+
 def itime():
     """returns time in an integer"""
     return int(time())
@@ -110,6 +110,7 @@ class Modable:
 
     EXTEND_DICT = 0
     EXTEND_DICT_LIST = 1
+    EXTEND_EVENTS = 2
 
     def load_module_config(self, module):
         if isinstance(module, ListType):
@@ -120,7 +121,7 @@ class Modable:
         if module in self.available_modules:
             if config.debug:
                 log.msg('Loading module config %s' % module)
-            config._parser.read([self.available_modules[module].getConfigFile()])
+            config.read([self.available_modules[module].getConfigFile()])
 
     def load(self, module):
         """Load a module or a list of modules"""
@@ -198,6 +199,12 @@ class Modable:
                     extendable[key].append(val)
                 else:
                     extendable[key] = [val]
+            elif extendable_type == self.__class__.EXTEND_EVENTS:
+                # handler or (handler, priority)
+                if isinstance(val, TupleType):
+                    extendable.subscribe(key, *val)
+                else:
+                    extendable.subscribe(key, val)
         
 
     def preload_modules(self):
@@ -268,7 +268,7 @@ class Tracker:
                 FROM tracker_%ss
             """% self.name)
             return txn.fetchall()
-        d = db.runInteraction(_itrxn)
+        d = db.runUnbatched(_itrxn)
 
         def _fillItems(items):
             self.listed.extend(items)
@@ -738,7 +738,8 @@ class Ban(Mask):
             if 'reason' in self.meta:
                 kickreason += self.meta['reason']
             kickreason += '[' + self.expiry() + ']'
-            for nick, ident, host, flags in users:
+            for nick, ident, host, flags in users.matching(
+                    self.meta['ban_masks']):
                 if self.tracker.cmp_masks(
                     '%s!%s@%s' % (nick, ident, host),
                     self.meta['ban_masks']
@@ -839,10 +840,10 @@ class Ban(Mask):
             user_d = defer.succeed([user])
         else:
             def _gotUserList(l):
-                for nick_, ident, host, flags in l:
-                    if nick == nick_:
-                        user = "%s!%s@%s" % (nick_, ident, host)
-                        return cls.find_banmask(user)
+                user = l.get(nick)
+                if user:
+                    nick_, ident, host, flags = user
+                    return cls.find_banmask("%s!%s@%s" % (nick_, ident, host))
                 else:
                     return ['%s!*@*' % nick]
 
@@ -865,7 +866,7 @@ class Ban(Mask):
                     meta['seen_nicks'].append(nick)
 
                 to_kick = []
-                for nick_, ident, host, flags in userlist:
+                for nick_, ident, host, flags in userlist.matching(masks):
                     mask_ = '%s!%s@%s' % (nick_, ident, host)
                     if tracker.cmp_masks(
                         mask_,
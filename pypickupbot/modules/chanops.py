@@ -41,9 +41,10 @@ class ChanOps:
 
     def irc_RPL_NAMREPLY(self, prefix, params):
         if params[2] == self.pypickupbot.channel:
-            for user in params[3].split():
-                if user[0] == '@':
-                    self.chanops.add(user[1:])
+            for entry in params[3].split():
+                nick, ident, host, modes = self.pypickupbot.parse_names(entry)
+                if 'o' in modes:
+                    self.chanops.add(nick)
 
     def userLeft(self, user, channel):
         if channel == self.pypickupbot.channel:
@@ -30,9 +30,10 @@ from pypickupbot.modable import SimpleModuleFactory
 from pypickupbot.irc import COMMAND, InputError
 from pypickupbot.topic import Topic
 from pypickupbot import config
+from pypickupbot.misc import irc_lower
 
 class Game:
-    """A game that can be played in the channel"""
+    """A game that can be played in a channel"""
     def __init__(self, pickup, nick, name, captains=2, players=8, autopick=False, **kwargs):
         self.pickup = pickup
         self.nick = nick
@@ -57,7 +58,7 @@ class Game:
 
         def _knowStart(start):
             if not start:
-                self.pickup.pypickupbot.cmsg(
+                self.pickup.pypickupbot.msg(self.pickup.channel,
                     _("%s game about to start..")%self.name
                 )
             else:
@@ -88,14 +89,14 @@ class Game:
             return
 
         players = self.players[:self.maxplayers]
-        for player in players:
-            self.pickup.all_games().force_remove(player)
+        # they can't play in another channel meanwhile
+        self.pickup.module.all_games().force_remove_many(players)
 
         self.pickup.update_topic()
 
-        self.pickup.pypickupbot.notice(self.pickup.pypickupbot.channel, 
+        self.pickup.pypickupbot.notice(self.pickup.channel, 
             _("%(gamenick)s game ready to start in %(channel)s")
-                % {'gamenick': self.nick, 'channel': self.pickup.pypickupbot.channel})
+                % {'gamenick': self.nick, 'channel': self.pickup.channel})
 
         captains = []
 
@@ -104,52 +105,50 @@ class Game:
             captains = random.sample(pickpool,2)
 
             self.pickup.pypickupbot.fire('pickup_game_starting', self, players, captains)
+            playerlist = ', '.join(players)
+            captainlist = ', '.join(captains)
             if len( captains ) > 0:
-                self.pickup.pypickupbot.msg( self.pickup.pypickupbot.channel,
-                    config.get('Pickup messages', 'game ready').decode('string-escape')%
+                self.pickup.pypickupbot.msg( self.pickup.channel,
+                    config.gettemplate('Pickup messages', 'game ready')%
                     {
                         'nick': self.nick,
                         'playernum': len(self.players),
                         'playermax': self.maxplayers,
                         'name': self.name,
                         'numcaps': self.caps,
-                        'playerlist': ', '.join(players),
-                        'captainlist': ', '.join(captains)
+                        'playerlist': playerlist,
+                        'captainlist': captainlist
+                    })
+                self._pm_players(players,
+                    config.gettemplate("Pickup messages", "youre needed")%
+                    {
+                        'channel': self.pickup.channel,
+                        'name': self.name,
+                        'nick': self.nick,
+                        'numcaps': self.caps,
+                        'playerlist': playerlist,
+                        'captainlist': captainlist
                     })
-                if config.getboolean("Pickup", "PM each player on start"):
-                    for player in players:
-                        self.pickup.pypickupbot.msg(player, 
-                            config.get("Pickup messages", "youre needed").decode('string-escape')%
-                            {
-                                'channel': self.pickup.pypickupbot.channel,
-                                'name': self.name,
-                                'nick': self.nick,
-                                'numcaps': self.caps,
-                                'playerlist': ', '.join(players),
-                                'captainlist': ', '.join(captains)
-                            })
             else:
-                self.pickup.pypickupbot.msg( self.pickup.pypickupbot.channel,
-                    config.get('Pickup messages', 'game ready nocaptains').decode('string-escape')%
+                self.pickup.pypickupbot.msg( self.pickup.channel,
+                    config.gettemplate('Pickup messages', 'game ready nocaptains')%
                     {
                         'nick': self.nick,
                         'playernum': len(self.players),
                         'playermax': self.maxplayers,
                         'name': self.name,
                         'numcaps': self.caps,
-                        'playerlist': ', '.join(players)
+                        'playerlist': playerlist
+                    })
+                self._pm_players(players,
+                    config.gettemplate("Pickup messages", "youre needed nocaptains")%
+                    {
+                        'channel': self.pickup.channel,
+                        'name': self.name,
+                        'nick': self.nick,
+                        'numcaps': self.caps,
+                        'playerlist': playerlist,
                     })
-                if config.getboolean("Pickup", "PM each player on start"):
-                    for player in players:
-                        self.pickup.pypickupbot.msg(player, 
-                            config.get("Pickup messages", "youre needed nocaptains").decode('string-escape')%
-                            {
-                                'channel': self.pickup.pypickupbot.channel,
-                                'name': self.name,
-                                'nick': self.nick,
-                                'numcaps': self.caps,
-                                'playerlist': ', '.join(players),
-                            })
         else:
             teams = [[] for i in range(self.caps)]
             players_ = sorted(players)
@@ -159,8 +158,8 @@ class Game:
                 teams[i % self.caps].append(player)
 
             self.pickup.pypickupbot.fire('pickup_game_starting', self, teams, captains)
-            self.pickup.pypickupbot.cmsg(
-                config.get('Pickup messages', 'game ready autopick').decode('string-escape')%
+            self.pickup.pypickupbot.msg(self.pickup.channel,
+                config.getescaped('Pickup messages', 'game ready autopick')%
                 {
                     'nick': self.nick,
                     'playernum': len(players),
@@ -168,7 +167,7 @@ class Game:
                     'name': self.name,
                     'numcaps': self.caps,
                     'teamslist': ', '.join([
-                        config.get('Pickup messages', 'game ready autopick team').decode('string-escape')%
+                        config.getescaped('Pickup messages', 'game ready autopick team')%
                         {
                             'name': self.teamname(i),
                             'players': ', '.join(team)
@@ -180,6 +179,11 @@ class Game:
 
         self.starting = False
 
+    def _pm_players(self, players, msg):
+        """Sends every player the same message, if enabled"""
+        if config.getboolean("Pickup", "PM each player on start"):
+            self.pickup.pypickupbot.msg_many(players, msg)
+
     def teamname(self, i):
         if len(self.teamnames) > i:
             return self.teamnames[i]
@@ -199,7 +203,7 @@ class Game:
     def who(self):
         """Who is in this game"""
         if len(self.players):
-            return config.get('Pickup messages', 'who game').decode('string-escape') % {'nick': self.nick, 'playernum': len(self.players), 'playermax': self.maxplayers, 'name': self.name, 'numcaps': self.caps, 'playerlist': ', '.join(self.players) }
+            return config.getescaped('Pickup messages', 'who game') % {'nick': self.nick, 'playernum': len(self.players), 'playermax': self.maxplayers, 'name': self.name, 'numcaps': self.caps, 'playerlist': ', '.join(self.players) }
 
     def remove(self, call, user):
         """Removes a player from this game"""
@@ -217,6 +221,19 @@ class Game:
         except ValueError:
             pass
 
+    def force_remove_many(self, users, update_topic=True):
+        """Removes several players at once
+
+        @returns: whether any of them was removed"""
+        users = set(users)
+        players = [player for player in self.players if player not in users]
+        if len(players) == len(self.players):
+            return False
+        self.players = players
+        if update_topic:
+            self.pickup.update_topic()
+        return True
+
     def rename(self, oldnick, newnick):
         """Rename a player"""
         try:
@@ -236,6 +253,11 @@ class Games(Game):
         for game in self.games: game.pre_start(*args)
     def force_remove(self, *args):
         for game in self.games: game.force_remove(*args)
+    def force_remove_many(self, users):
+        removed = [game for game in self.games
+            if game.force_remove_many(users, update_topic=False)]
+        for pickup in set(game.pickup for game in removed):
+            pickup.update_topic()
     def rename(self, *args):
         for game in self.games: game.rename(*args)
 
@@ -258,8 +280,41 @@ class Games(Game):
         return self
 
 
-class PickupBot:
-    """Allows the bot to run games with captain-picked teams"""
+class ChannelPickups:
+    """The games of one channel"""
+
+    def __init__(self, module, bot, channel):
+        """Reads games from config"""
+        self.module = module
+        self.pypickupbot = bot
+        self.channel = channel
+        self.topic = None
+        self.games = {}
+        self.order = []
+        self.last_promote = 0
+
+        for (gamenick, gamename) in config.items('Pickup games'):
+            if gamenick == 'order':
+                self.order = config.getlist('Pickup games', 'order')
+            else:
+                if config.has_section('Pickup: '+gamenick):
+                    gamesettings = dict(config.items('Pickup: '+gamenick))
+                else:
+                    gamesettings = {}
+                self.games[gamenick] = Game(
+                    self,
+                    gamenick, gamename,
+                    **gamesettings)
+                if gamenick not in self.order:
+                    self.order.append(gamenick)
+
+        self.order = filter(lambda x: x in self.games, self.order)
+
+    def joined(self, context):
+        """when the channel is joined, set topic"""
+        if config.get('Pickup', 'topic'):
+            self.topic = context.topic.add('', Topic.GRAVITY_BEGINNING)
+            self.update_topic()
 
     def all_games(self):
         """Gets a wrapper for all games"""
@@ -299,7 +354,7 @@ class PickupBot:
         """Update the pickup part of the channel topic"""
         config_topic = config.getint('Pickup', 'topic')
 
-        if not config_topic:
+        if not config_topic or self.topic == None:
             return
 
         out = []
@@ -307,7 +362,7 @@ class PickupBot:
             game = self.games[gamenick]
             if config_topic == 1 or game.players:
                 out.append(
-                    config.get('Pickup messages', 'topic game').decode('string-escape')
+                    config.getescaped('Pickup messages', 'topic game')
                     % {
                         'nick': game.nick, 'playernum': len(game.players),
                         'playermax': game.maxplayers, 'name': game.name,
@@ -315,11 +370,39 @@ class PickupBot:
                     })
 
         self.topic.update(
-            config.get('Pickup messages', 'topic game separator')\
-                .decode('string-escape')\
+            config.getescaped('Pickup messages', 'topic game separator')\
             .join(out)
             )
 
+class PickupBot:
+    """Allows the bot to run games with captain-picked teams, in as many
+    channels as set in the config"""
+
+    def all_games(self):
+        """Gets a wrapper for the games of all channels"""
+        return Games([game for pickups in self.channels.itervalues()
+            for game in pickups.games.itervalues()])
+
+    def get_pickups(self, call):
+        """Gets the games of the channel the call was made in, or of the
+        first pickup channel for private messages"""
+        if call.channel == 'PM':
+            channel = self.home
+        else:
+            channel = irc_lower(call.channel)
+        try:
+            return self.channels[channel]
+        except KeyError:
+            raise InputError(_("There are no pickups in this channel."))
+
+    def get_games(self, call, args, implicit_all=True):
+        """Gets all or some games of the call's channel"""
+        return self.get_pickups(call).get_games(call, args, implicit_all)
+
+    def get_game(self, call, args):
+        """Get one game of the call's channel"""
+        return self.get_pickups(call).get_game(call, args)
+
     def add(self, call, args):
         """!add [game [game ..]]
 
@@ -340,17 +423,17 @@ class PickupBot:
         Shows who has signed up"""
         games = [i for i in self.get_games(call, args).who() if i != None]
         all = False
-        if len(args) < 1 or len(args) == len(self.games):
+        if len(args) < 1 or len(args) == len(self.get_pickups(call).games):
             all = True
         if len(games):
             if all:
-                call.reply(_("All games:")+" "+config.get('Pickup messages', 'who game separator').decode('string-escape').join(games),
+                call.reply(_("All games:")+" "+config.getescaped('Pickup messages', 'who game separator').join(games),
 
 
-                    config.get('Pickup messages', 'who game separator').decode('string-escape'))
+                    config.getescaped('Pickup messages', 'who game separator'))
             else:
-                call.reply(config.get('Pickup messages', 'who game separator').decode('string-escape').join(games),
-                    config.get('Pickup messages', 'who game separator').decode('string-escape'))
+                call.reply(config.getescaped('Pickup messages', 'who game separator').join(games),
+                    config.getescaped('Pickup messages', 'who game separator'))
         else:
             if all:
                 call.reply(_("No game going on!"))
@@ -362,25 +445,26 @@ class PickupBot:
 
         Shows a notice encouraging players to sign up for the specified game"""
         admin = self.pypickupbot.is_admin(call.user, call.nick)
+        pickups = self.get_pickups(call)
 
         def _knowAdmin(admin):
-            if self.last_promote + config.getint('Pickup', 'promote delay') > time() \
+            if pickups.last_promote + config.getint('Pickup', 'promote delay') > time() \
                     and not admin:
                 raise InputError(_("Can't promote so often."))
 
-            game = self.get_game(call, args)
+            game = pickups.get_game(call, args)
 
             if call.nick not in game.players \
                     and not admin:
                 raise InputError(_("Join the game yourself before promoting it."))
 
-            self.last_promote = time()
-            self.pypickupbot.cmsg(
-                config.get('Pickup messages', 'promote').decode('string-escape') % {
+            pickups.last_promote = time()
+            self.pypickupbot.msg(pickups.channel,
+                config.getescaped('Pickup messages', 'promote') % {
                     'bold': '\x02', 'prefix': config.get('Bot', 'command prefix'),
                     'name': game.name, 'nick': game.nick,
                     'command': config.get('Bot', 'command prefix')+'add '+game.nick,
-                    'channel': self.pypickupbot.channel,
+                    'channel': pickups.channel,
                     'playersneeded': game.maxplayers-len(game.players),
                     'maxplayers': game.maxplayers, 'numplayers': len(game.players),
                 })
@@ -416,7 +500,7 @@ class PickupBot:
         """
         call.reply( ', '.join(
                 ["%s (%s)" % (nick, game.name)
-                for nick, game in self.games.iteritems()
+                for nick, game in self.get_pickups(call).games.iteritems()
                 if not args or args[0] in nick or args[0] in game.name.lower()]
             ), ', ')
 
@@ -424,38 +508,24 @@ class PickupBot:
     def __init__(self, bot):
         """Plugin init
 
-        Reads games from config"""
-        self.games = {}
-        self.order = []
-        self.last_promote = 0
+        Sets up the games of each pickup channel"""
+        self.channels = {}  # irc_lower(channel) : ChannelPickups
+        channels = filter(None, config.getlist('Pickup', 'channels')) \
+            or [bot.channel]
+        self.home = irc_lower(channels[0])
         if not config.has_section('Pickup games'):
             log.err('Could not find section "Pickup games" of the config!')
             return
-        games = config.items('Pickup games')
-#        log.msg(games)
 
-        for (gamenick, gamename) in games:
-            if gamenick == 'order':
-                self.order = config.getlist('Pickup games', 'order')
-            else:
-                if config.has_section('Pickup: '+gamenick):
-                    gamesettings = dict(config.items('Pickup: '+gamenick))
-                else:
-                    gamesettings = {}
-                self.games[gamenick] = Game(
-                    self,
-                    gamenick, gamename,
-                    **gamesettings)
-                if gamenick not in self.order:
-                    self.order.append(gamenick)
-
-        self.order = filter(lambda x: x in self.games, self.order)
+        for channel in channels:
+            self.channels[irc_lower(channel)] = \
+                ChannelPickups(self, bot, channel)
 
-    def joinedHomeChannel(self):
-        """when home channel joined, set topic"""
-        if config.get('Pickup', 'topic'):
-            self.topic = self.pypickupbot.topic.add('', Topic.GRAVITY_BEGINNING)
-            self.update_topic()
+    def joinedChannel(self, context):
+        """when a pickup channel is joined, set its topic"""
+        pickups = self.channels.get(irc_lower(context.name))
+        if pickups:
+            pickups.joined(context)
 
     def userRenamed(self, oldname, newname):
         """track user renames"""
@@ -463,12 +533,14 @@ class PickupBot:
 
     def userLeft(self, user, channel, *args):
         """track quitters"""
-        if channel == self.pypickupbot.channel:
-            self.all_games().force_remove(user.split('!')[0])
+        pickups = self.channels.get(irc_lower(channel))
+        if pickups:
+            pickups.all_games().force_remove(user.split('!')[0])
     
-    def userQuit(self, user, quitMessage):
-        """track quitters"""
-        self.all_games().force_remove(user.split('!')[0])
+    def usersQuit(self, users):
+        """track quitters, all of a netsplit at once"""
+        self.all_games().force_remove_many(
+            [user.split('!')[0] for user, quitMessage in users])
 
     commands = {
         'add': (add, COMMAND.NOT_FROM_PM),
@@ -485,11 +557,11 @@ class PickupBot:
         }
 
     eventhandlers = {
-        'joinedHomeChannel': joinedHomeChannel,
+        'joinedChannel': joinedChannel,
         'userRenamed': userRenamed,
         'userLeft': userLeft,
         'userKicked': userLeft,
-        'userQuit': userQuit,
+        'usersQuit': usersQuit,
     }
 
 pickup = SimpleModuleFactory(PickupBot)
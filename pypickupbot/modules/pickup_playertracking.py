@@ -24,7 +24,7 @@ from time import time
 from datetime import datetime
 import json
 
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from twisted.python import log
 
 from pypickupbot.modable import SimpleModuleFactory
@@ -34,10 +34,85 @@ from pypickupbot.irc import COMMAND, InputError
 from pypickupbot.misc import str_from_timediff, timediff_from_str,\
     InvalidTimeDiffString, StringTypes, itime
 
+def _month(time_):
+    """Month of a timestamp, as in the summary tables (YYYYMM, UTC)"""
+    date = datetime.utcfromtimestamp(time_)
+    return date.year * 100 + date.month
+
+_MONTH = "CAST(strftime('%Y%m', time, 'unixepoch') AS INTEGER)"
+
+def _flatten(players):
+    """Player names out of a list of names or of teams"""
+    for player in players:
+        if isinstance(player, StringTypes):
+            yield player
+        else:
+            for player_ in _flatten(player):
+                yield player_
+
+def _participants(players, captains):
+    """(name, team, is captain) of everyone in a game, players being a list
+    of names or of teams. team is None when players are a list of names."""
+    captains = set(captains)
+    if players and not isinstance(players[0], StringTypes):
+        for team, members in enumerate(players):
+            for name in _flatten(members):
+                yield name, team, name in captains
+    else:
+        for name in players:
+            yield name, None, name in captains
+
+def _decode_players(blob):
+    """Players or captains as stored in pickup_games before version 5 of
+    the schema: json, or names separated by spaces in older versions"""
+    if not blob:
+        return []
+    if blob.startswith('['):
+        try:
+            return json.loads(blob)
+        except ValueError:
+            pass # a nick starting with [
+    return blob.split()
+
+def _normalize_players(txn):
+    """Moves teams and captains out of pickup_games' json into columns of
+    pickup_players_games"""
+    txn.execute("PRAGMA table_info(pickup_players_games)")
+    columns = [row[1] for row in txn.fetchall()]
+    if 'team' not in columns:
+        txn.execute("ALTER TABLE pickup_players_games ADD COLUMN team INTEGER")
+    if 'captain' not in columns:
+        txn.execute("""
+            ALTER TABLE pickup_players_games
+            ADD COLUMN captain INTEGER NOT NULL DEFAULT 0""")
+    txn.execute("""
+        CREATE INDEX IF NOT EXISTS
+        pickup_players_games_game_id
+        ON pickup_players_games(game_id)""")
+
+    txn.execute("""
+        SELECT  id, game, time, players, captains
+        FROM    pickup_games
+        WHERE   players IS NOT NULL""")
+    games = txn.fetchall()
+    # rewritten from the json, in the order lastgame lists them
+    txn.executemany("DELETE FROM pickup_players_games WHERE game_id=?",
+        [(id_,) for id_, game, time_, players, captains in games])
+    txn.executemany("""
+        INSERT INTO
+        pickup_players_games(game_id, name, game, time, team, captain)
+        VALUES(?, ?, ?, ?, ?, ?)
+        """, [(id_, name, game, time_, team, int(captain))
+            for id_, game, time_, players, captains in games
+            for name, team, captain in _participants(
+                _decode_players(players), _decode_players(captains))])
+    txn.execute("UPDATE pickup_games SET players=NULL, captains=NULL")
+
 class PlayerTracking:
 
-    def __init__(self, bot):
-        db.runOperation("""
+    migrations = [
+        [
+            """
             CREATE TABLE IF NOT EXISTS
             pickup_games
             (
@@ -46,8 +121,8 @@ class PlayerTracking:
                 time    INTEGER,
                 players TEXT,
                 captains TEXT
-            )""")
-        db.runOperation("""
+            )""",
+            """
             CREATE TABLE IF NOT EXISTS
             pickup_players_games
             (
@@ -55,52 +130,415 @@ class PlayerTracking:
                 name    TEXT,
                 game    TEXT,
                 time    INTEGER
-            )
-            """)
+            )""",
+        ],
+        [
+            # lastgame(s) and top10 look up recent games of given modes
+            """
+            CREATE INDEX IF NOT EXISTS
+            pickup_games_game_time
+            ON pickup_games(game, time)""",
+            """
+            CREATE INDEX IF NOT EXISTS
+            pickup_players_games_game_time
+            ON pickup_players_games(game, time)""",
+            """
+            CREATE INDEX IF NOT EXISTS
+            pickup_players_games_name_game_time
+            ON pickup_players_games(name, game, time)""",
+        ],
+        [
+            # filled in only with "daily counts" enabled
+            """
+            CREATE TABLE IF NOT EXISTS
+            pickup_player_counts
+            (
+                game    TEXT,
+                day     INTEGER,
+                name    TEXT,
+                count   INTEGER,
+                PRIMARY KEY (game, day, name)
+            )""",
+        ],
+        [
+            # games older than "archive after" are summed up per month
+            """
+            CREATE TABLE IF NOT EXISTS
+            pickup_player_months
+            (
+                game    TEXT,
+                month   INTEGER,
+                name    TEXT,
+                count   INTEGER,
+                PRIMARY KEY (game, month, name)
+            )""",
+            """
+            CREATE TABLE IF NOT EXISTS
+            pickup_game_months
+            (
+                game    TEXT,
+                month   INTEGER,
+                games   INTEGER,
+                first   INTEGER,
+                last    INTEGER,
+                PRIMARY KEY (game, month)
+            )""",
+            """
+            CREATE INDEX IF NOT EXISTS
+            pickup_games_time
+            ON pickup_games(time)""",
+            """
+            CREATE INDEX IF NOT EXISTS
+            pickup_players_games_time
+            ON pickup_players_games(time)""",
+        ],
+        # one row per player in pickup_players_games, with its team index
+        # (NULL unless teams were autopicked) and whether it was a captain
+        _normalize_players,
+        [
+            # lifetime counts for !stats, kept up to date as games start.
+            # game is '' for the counts over every mode.
+            """
+            CREATE TABLE IF NOT EXISTS
+            pickup_player_stats
+            (
+                name        TEXT COLLATE NOCASE,
+                game        TEXT,
+                games       INTEGER,
+                captained   INTEGER,
+                last        INTEGER,
+                PRIMARY KEY (name, game)
+            )""",
+            """
+            CREATE TABLE IF NOT EXISTS
+            pickup_teammates
+            (
+                name    TEXT COLLATE NOCASE,
+                game    TEXT,
+                mate    TEXT COLLATE NOCASE,
+                count   INTEGER,
+                PRIMARY KEY (name, game, mate)
+            )""",
+            """
+            CREATE INDEX IF NOT EXISTS
+            pickup_teammates_count
+            ON pickup_teammates(name, game, count)""",
+            # from the games recorded so far, the name being spelled as in
+            # the latest one
+            """
+            INSERT OR REPLACE INTO
+            pickup_player_stats(name, game, games, captained, last)
+            SELECT      name, game, COUNT(*), SUM(captain), MAX(time)
+            FROM        pickup_players_games
+            GROUP BY    name COLLATE NOCASE, game
+            UNION ALL
+            SELECT      name, '', COUNT(*), SUM(captain), MAX(time)
+            FROM        pickup_players_games
+            GROUP BY    name COLLATE NOCASE""",
+            """
+            INSERT OR REPLACE INTO
+            pickup_teammates(name, game, mate, count)
+            SELECT      a.name, a.game, b.name, COUNT(*)
+            FROM        pickup_players_games a
+            JOIN        pickup_players_games b
+                        ON b.game_id = a.game_id AND b.team IS a.team
+                        AND b.name != a.name
+            GROUP BY    a.name COLLATE NOCASE, a.game, b.name COLLATE NOCASE
+            UNION ALL
+            SELECT      a.name, '', b.name, COUNT(*)
+            FROM        pickup_players_games a
+            JOIN        pickup_players_games b
+                        ON b.game_id = a.game_id AND b.team IS a.team
+                        AND b.name != a.name
+            GROUP BY    a.name COLLATE NOCASE, b.name COLLATE NOCASE""",
+        ],
+        ]
+
+    def __init__(self, bot):
+        self.daily_counts = config.getboolean("Pickup player tracking",
+            "daily counts")
+        self.next_archive = None
+        d = db.migrate('pickup_playertracking', self.migrations)
+        d.addCallback(lambda version:
+            db.runInteraction(self._sync_daily_counts))
+        d.addCallback(lambda r: self.archive())
 
         self.pickup = bot.load('pickup')
 
-    def top10(self, call, args):
-        """!top10 [game [game ..]]
-        
-        Shows who participated most in said game(s)."""
-        games_ = self.pickup.get_games(call, args)
-        games = [game.nick for game in games_.games]
+    def archive(self):
+        """Moves games older than "archive after" into the monthly
+        summaries, a chunk at a time so that other writes aren't held up"""
+        if self.next_archive != None and self.next_archive.active():
+            self.next_archive.cancel()
+        self.next_archive = None
+        age = config.getduration("Pickup player tracking", "archive after")
+        if not age:
+            return
 
-        def _doTransaction(txn):
-            params = dict(zip([str(i) for i in range(len(games))], games))
-            params.update({'time': itime()-config.getduration("Pickup player tracking", "top10 spread")})
+        def _archived(more):
+            if more:
+                delay = 0
+            else:
+                delay = config.getduration("Pickup player tracking",
+                    "archive interval")
+            self.next_archive = reactor.callLater(delay, self.archive)
+        d = db.runInteraction(self._archive_chunk, itime() - age,
+            config.getint("Pickup player tracking", "archive chunk size"))
+        d.addCallback(_archived)
+        d.addErrback(log.err, "archiving games")
+        return d
+
+    def _archive_chunk(self, txn, limit, size):
+        """Summarizes and deletes the oldest player entries before limit,
+        about size of them
+
+        @returns: whether there are more to archive"""
+        txn.execute("""
+            SELECT      time
+            FROM        pickup_players_games
+            WHERE       time < ?
+            ORDER BY    time
+            LIMIT 1 OFFSET ?
+            """, (limit, size - 1))
+        row = txn.fetchone()
+        more = row != None
+        end = row[0] if more else limit - 1
+
+        txn.execute("""
+            SELECT      game, """ + _MONTH + """, name, COUNT(*)
+            FROM        pickup_players_games
+            WHERE       time <= ?
+            GROUP BY    1, 2, 3
+            """, (end,))
+        players = txn.fetchall()
+        txn.executemany("""
+            INSERT OR IGNORE INTO
+            pickup_player_months(game, month, name, count)
+            VALUES(?, ?, ?, 0)
+            """, [(game, month, name) for game, month, name, count in players])
+        txn.executemany("""
+            UPDATE  pickup_player_months
+            SET     count = count + ?
+            WHERE   game=? AND month=? AND name=?
+            """, [(count, game, month, name)
+                for game, month, name, count in players])
+
+        txn.execute("""
+            SELECT      game, """ + _MONTH + """, COUNT(*), MIN(time), MAX(time)
+            FROM        pickup_games
+            WHERE       time <= ?
+            GROUP BY    1, 2
+            """, (end,))
+        games = txn.fetchall()
+        txn.executemany("""
+            INSERT OR IGNORE INTO
+            pickup_game_months(game, month, games, first, last)
+            VALUES(?, ?, 0, ?, ?)
+            """, [(game, month, first, last)
+                for game, month, count, first, last in games])
+        txn.executemany("""
+            UPDATE  pickup_game_months
+            SET     games = games + ?,
+                    first = MIN(first, ?),
+                    last = MAX(last, ?)
+            WHERE   game=? AND month=?
+            """, [(count, first, last, game, month)
+                for game, month, count, first, last in games])
+
+        for table in ['pickup_players_games', 'pickup_games']:
+            txn.execute("DELETE FROM " + table + " WHERE time <= ?", (end,))
+
+        if self.daily_counts:
+            # archived days are now counted in the monthly summaries
+            txn.execute("""
+                DELETE FROM pickup_player_counts
+                WHERE       day <= ?
+                """, (end // 86400,))
+            self._count_days(txn, [end // 86400])
+
+        if players or games:
+            log.msg("Archived {0} games and {1} player entries up to {2}"
+                .format(sum(g[2] for g in games), sum(p[3] for p in players),
+                    datetime.fromtimestamp(end)))
+        return more
+
+    def _sync_daily_counts(self, txn):
+        """Rebuilds the daily counts when they were just enabled, empties
+        them when they were just disabled"""
+        txn.execute("SELECT val FROM meta WHERE key='pickup_player_counts'")
+        enabled = txn.fetchone() != None
+        if enabled == self.daily_counts:
+            return
+        txn.execute("DELETE FROM pickup_player_counts")
+        if self.daily_counts:
+            self._count_days(txn)
             txn.execute("""
-                SELECT name FROM pickup_players_games
-                WHERE
-                    (""" + \
-                    ' OR '.join(['game=:%d' % i for i in range(len(games))]) \
-                    + """)
-                    AND time>:time""", params )
+                INSERT INTO meta(key, val)
+                VALUES('pickup_player_counts', '1')
+                """)
+        else:
+            txn.execute("DELETE FROM meta WHERE key='pickup_player_counts'")
 
-            players = {}
+    def _count_days(self, txn, days=None):
+        """Fills in the daily counts from recorded games, of all days or
+        of the given days only"""
+        if days == None:
+            where, params = "", ()
+        else:
+            where = "WHERE time / 86400 IN (%s)" % ', '.join('?' * len(days))
+            params = tuple(days)
+        txn.execute("""
+            INSERT INTO pickup_player_counts(game, day, name, count)
+            SELECT      game, time / 86400, name, COUNT(*)
+            FROM        pickup_players_games
+            """ + where + """
+            GROUP BY    game, time / 86400, name
+            """, params)
 
-            for (player,) in txn.fetchall():
-                try:
-                    players[player] += 1
-                except KeyError:
-                    players[player] = 1
+    def _count_stats(self, txn, game, time_, players, captains):
+        """Adds a game to its players' stats, in its mode and in all modes"""
+        participants = list(_participants(players, captains))
+        stats = [(name, game_, int(captain))
+            for name, team, captain in participants
+            for game_ in (game, '')]
+        txn.executemany("""
+            INSERT OR IGNORE INTO
+            pickup_player_stats(name, game, games, captained, last)
+            VALUES(?, ?, 0, 0, 0)
+            """, [(name, game_) for name, game_, captain in stats])
+        txn.executemany("""
+            UPDATE  pickup_player_stats
+            SET     games = games + 1,
+                    captained = captained + ?,
+                    last = ?,
+                    name = ?
+            WHERE   name=? AND game=?
+            """, [(captain, time_, name, name, game_)
+                for name, game_, captain in stats])
 
-            ordered = players.items()
-            ordered.sort(None, lambda x: x[1], True)
+        # teams aren't known in captain-picked games, everyone there counts
+        mates = [(name, game_, mate)
+            for name, team, captain in participants
+            for mate, team_, captain_ in participants
+            if mate != name and team_ == team
+            for game_ in (game, '')]
+        txn.executemany("""
+            INSERT OR IGNORE INTO
+            pickup_teammates(name, game, mate, count)
+            VALUES(?, ?, ?, 0)
+            """, mates)
+        txn.executemany("""
+            UPDATE  pickup_teammates
+            SET     count = count + 1,
+                    mate = ?
+            WHERE   name=? AND game=? AND mate=?
+            """, [(mate, name, game_, mate) for name, game_, mate in mates])
 
-            return ordered[:10]
+    def stats(self, call, args):
+        """!stats <nick> [game]
 
-        d = db.runInteraction(_doTransaction)
+        Shows how many games someone played, how many of them as captain,
+        when they last played and with whom they played most."""
+        if not len(args) or len(args) > 2:
+            raise InputError(_("Usage: !stats <nick> [game]"))
+        nick = args[0]
+        if len(args) > 1:
+            game = self.pickup.get_game(call, args[1:])
+            gamenick, gamename = game.nick, game.name
+        else:
+            gamenick, gamename = '', _("pickup")
+        params = {
+            'nick': nick,
+            'game': gamenick,
+            'teammates': config.getint("Pickup player tracking",
+                "stats teammates"),
+            }
+        d = defer.gatherResults([
+            db.runQuery("""
+                SELECT  name, games, captained, last
+                FROM    pickup_player_stats
+                WHERE   name=:nick AND game=:game
+                """, params),
+            db.runQuery("""
+                SELECT      mate, count
+                FROM        pickup_teammates
+                WHERE       name=:nick AND game=:game
+                ORDER BY    count DESC
+                LIMIT       :teammates
+                """, params),
+            ])
+        def _printResult((stats, teammates)):
+            if not stats:
+                call.reply(_("No {0} game recorded for {1}").format(
+                    gamename, nick))
+                return
+            name, games, captained, last = stats[0]
+            call.reply(config.getescaped('Pickup player tracking', 'stats') % {
+                'nick': name,
+                'game': gamenick,
+                'name': gamename,
+                'games': games,
+                'captained': captained,
+                'when': str_from_timediff(itime() - last),
+                'teammates': ', '.join([
+                    config.getescaped('Pickup player tracking', 'stats teammate') % {
+                        'nick': mate,
+                        'count': count,
+                    }
+                    for mate, count in teammates]) or _("nobody yet"),
+                })
+        d.addCallback(_printResult)
+
+    def top10(self, call, args):
+        """!top10 [game [game ..]]
+        
+        Shows who participated most in said game(s)."""
+        games_ = self.pickup.get_games(call, args)
+        games = [game.nick for game in games_.games]
+
+        params = dict(zip([str(i) for i in range(len(games))], games))
+        params['time'] = itime() - config.getduration("Pickup player tracking", "top10 spread")
+        in_games = ', '.join([':%d' % i for i in range(len(games))])
+        # archived games count by whole months, the oldest one included
+        params['month'] = _month(params['time'])
+        if self.daily_counts:
+            # counts whole days, the oldest one included
+            params['day'] = params['time'] // 86400
+            recent = """
+                SELECT      name, SUM(count) AS count
+                FROM        pickup_player_counts
+                WHERE       game IN (""" + in_games + """)
+                            AND day >= :day
+                GROUP BY    name"""
+        else:
+            recent = """
+                SELECT      name, COUNT(*) AS count
+                FROM        pickup_players_games
+                WHERE       game IN (""" + in_games + """)
+                            AND time > :time
+                GROUP BY    name"""
+        d = db.runQuery("""
+            SELECT      name, SUM(count) AS total
+            FROM        (""" + recent + """
+                UNION ALL
+                SELECT      name, SUM(count) AS count
+                FROM        pickup_player_months
+                WHERE       game IN (""" + in_games + """)
+                            AND month >= :month
+                GROUP BY    name
+                )
+            GROUP BY    name
+            ORDER BY    total DESC
+            LIMIT 10""", params)
 
         def _cback(playerlist):
-            o = [config.get('Pickup player tracking', 'top10 player').decode('string-escape') % {
+            o = [config.getescaped('Pickup player tracking', 'top10 player') % {
                     'player': player,
                     'count': count,
                     }
                 for player, count in playerlist]
             call.reply(
-                config.get('Pickup player tracking', 'top10').decode('string-escape') % {
+                config.getescaped('Pickup player tracking', 'top10') % {
                     'playerlist': ', '.join(o),
                     'games': ' '.join(games)
                 }, ', ')
@@ -108,13 +546,36 @@ class PlayerTracking:
 
     def _purge(self, keep=0):
         """used by clearGames and purgeGames"""
+        limit = itime() - keep
         res = defer.gatherResults([
             db.runOperation("""
                 DELETE FROM """ + table + """
                 WHERE time < ?
-                """, (itime() - keep,))
+                """, (limit,))
             for table in ['pickup_games', 'pickup_players_games']
+            ] + [
+            # summaries of months that ended before the limit, all of them
+            # when clearing
+            db.runOperation("""
+                DELETE FROM """ + table + """
+                WHERE month < ?
+                """, (_month(limit) if keep else 999999,))
+            for table in ['pickup_player_months', 'pickup_game_months']
+            ] + [
+            # stats are over every game ever played, only clearing resets them
+            db.runOperation("DELETE FROM " + table)
+            for table in ['pickup_player_stats', 'pickup_teammates']
+            if not keep
             ])
+        if self.daily_counts:
+            def _recount(txn):
+                # the day the limit falls on is only partly purged
+                txn.execute("""
+                    DELETE FROM pickup_player_counts
+                    WHERE       day <= ?
+                    """, (limit // 86400,))
+                self._count_days(txn, [limit // 86400])
+            res.addCallback(lambda r: db.runInteraction(_recount))
         def onErr(failure):
             log.err(failure, "purge games, keep = {0}".format(keep))
             return failure
@@ -124,7 +585,8 @@ class PlayerTracking:
     def clearGames(self, call, args):
         """!cleargames
         
-        Clears the played games list. This does empty the top10 list.
+        Clears the played games list. This does empty the top10 list
+        and everyone's stats.
         Prefer the purgegames command to this."""
         d = call.confirm("This will delete all recorded games, continue?")
         def _confirmed(ret):
@@ -170,21 +632,23 @@ class PlayerTracking:
                 id = int(args[0][1:])
             except ValueError:
                 raise InputError("Game id must be an integer")
-            d = db.runQuery("""
-                SELECT game, time, players, captains, id
-                FROM pickup_games
-                WHERE id=?
-                LIMIT 1""", (id,))
+            where, params = "g.id = :id", {'id': id}
         else:
             games_ = self.pickup.get_games(call, args)
             games = [game.nick for game in games_.games]
-            params = dict(zip([str(i) for i in range(len(games))], games)) 
-            d = db.runQuery("""
-                SELECT game, time, players, captains, id
+            params = dict(zip([str(i) for i in range(len(games))], games))
+            where = """g.id = (
+                SELECT id
                 FROM pickup_games
-                WHERE """+ ' OR '.join(['game=:%d' % i for i in range(len(games))]) +"""
+                WHERE game IN (""" + ', '.join([':%d' % i for i in range(len(games))]) + """)
                 ORDER BY time DESC
-                LIMIT 1""", params)
+                LIMIT 1)"""
+        d = db.runQuery("""
+            SELECT g.game, g.time, g.id, p.name, p.team, p.captain
+            FROM pickup_games g
+            LEFT JOIN pickup_players_games p ON p.game_id = g.id
+            WHERE """ + where + """
+            ORDER BY p.rowid""", params)
         def _printResult(r):
             if len(r) < 1:
                 if args and args[0].startswith('#'):
@@ -192,13 +656,17 @@ class PlayerTracking:
                 else:
                     call.reply(_("No game played yet in mode(s): {0}").format(' '.join(games)))
                 return
-            gamenick, gtime, players_, captains_, id_ = r[0]
-            if ',' in players_:
-                players = json.loads(players_)
-                captains = json.loads(captains_)
-            else:
-                players = players_.split()
-                captains = captains_.split()
+            gamenick, gtime, id_ = r[0][:3]
+            players, captains, teams = [], [], {}
+            for row in r:
+                name, team, captain = row[3:]
+                if name == None:
+                    continue
+                players.append(name)
+                if captain:
+                    captains.append(name)
+                if team != None:
+                    teams.setdefault(team, []).append(name)
             try:
                 game = self.pickup.get_game(call, [gamenick])
                 gamename = game.name
@@ -209,33 +677,33 @@ class PlayerTracking:
 
             timestr = str_from_timediff(itime()-gtime)
 
-            if captains:
-                call.reply(config.get('Pickup player tracking', 'lastgame').decode('string-escape') % \
+            if teams:
+                call.reply(config.getescaped('Pickup player tracking', 'lastgame autopick') % \
                     {
                         'name': gamename,
                         'nick': gamenick,
                         'id': id_,
                         'when': timestr,
-                        'playerlist': ', '.join(players),
-                        'captainlist': ', '.join(captains)
+                        'teamslist': ', '.join([
+                            config.getescaped('Pickup messages', 'game ready autopick team')%
+                            {
+                                'name': teamnameFactory(i),
+                                'players': ', '.join(teams[i])
+                            }
+                            for i in sorted(teams)])
                     })
-            elif not isinstance(players[0], StringTypes):
-                call.reply(config.get('Pickup player tracking', 'lastgame autopick').decode('string-escape') % \
+            elif captains:
+                call.reply(config.getescaped('Pickup player tracking', 'lastgame') % \
                     {
                         'name': gamename,
                         'nick': gamenick,
                         'id': id_,
                         'when': timestr,
-                        'teamslist': ', '.join([
-                            config.get('Pickup messages', 'game ready autopick team').decode('string-escape')%
-                            {
-                                'name': teamnameFactory(i),
-                                'players': ', '.join(team)
-                            }
-                            for i, team in enumerate(players)])
+                        'playerlist': ', '.join(players),
+                        'captainlist': ', '.join(captains)
                     })
             else:
-                call.reply(config.get('Pickup player tracking', 'lastgame nocaptains').decode('string-escape') % \
+                call.reply(config.getescaped('Pickup player tracking', 'lastgame nocaptains') % \
                     {
                         'name': gamename,
                         'nick': gamenick,
@@ -260,11 +728,23 @@ class PlayerTracking:
             ORDER BY time DESC
             LIMIT 10
         """, params)
-        def _printResult(r):
+        def _gotGames(r):
+            if len(r) >= 10:
+                return r, []
+            # make up for the rest with archived months
+            params['left'] = 10 - len(r)
+            return db.runQuery("""
+                SELECT game, month, games
+                FROM pickup_game_months
+                WHERE """+ ' OR '.join(['game=:%d' % i for i in range(len(games))]) +"""
+                ORDER BY month DESC, last DESC
+                LIMIT :left
+            """, params).addCallback(lambda months: (r, months))
+        def _printResult((r, months)):
             o = []
             for nick, ts, id in r:
                 date = datetime.fromtimestamp(ts)
-                o.append(config.get('Pickup player tracking', 'lastgames game').decode('string-escape') % {
+                o.append(config.getescaped('Pickup player tracking', 'lastgames game') % {
                     'year': date.year,
                     'month': date.month,
                     'day': date.day,
@@ -273,25 +753,32 @@ class PlayerTracking:
                     'nick': nick,
                     'id': id,
                 })
+            for nick, month, count in months:
+                o.append(config.getescaped('Pickup player tracking', 'lastgames month') % {
+                    'year': month // 100,
+                    'month': month % 100,
+                    'nick': nick,
+                    'count': count,
+                })
             o.reverse()
-            call.reply(config.get('Pickup player tracking', 'lastgames').decode('string-escape')%{
+            call.reply(config.getescaped('Pickup player tracking', 'lastgames')%{
                 'games': ', '.join(games),
-                'lastgames': config.get('Pickup player tracking', 'lastgames separator').decode('string-escape').join(o)
-                }, config.get('Pickup player tracking', 'lastgames separator').decode('string-escape'))
+                'lastgames': config.getescaped('Pickup player tracking', 'lastgames separator').join(o)
+                }, config.getescaped('Pickup player tracking', 'lastgames separator'))
+        d.addCallback(_gotGames)
         d.addCallback(_printResult)
 
     def pickup_game_started(self, game, players, captains):
+        time_ = itime()
         def _insertGame(txn):
             txn.execute("""
                 INSERT INTO
-                pickup_games(game, time, players, captains)
-                VALUES(:game, :time, :players, :captains)
+                pickup_games(game, time)
+                VALUES(:game, :time)
             """,
             {
                 'game': game.nick,
-                'time': itime(),
-                'players': json.dumps(players, separators=(',',':')),
-                'captains': json.dumps(captains, separators=(',',':')),
+                'time': time_,
             })
 
             txn.execute("SELECT last_insert_rowid() AS id")
@@ -299,19 +786,32 @@ class PlayerTracking:
 
             id_ = result[0][0]
 
-            def _insertPlayers(playerlist):
-                for player in playerlist:
-                    if isinstance(player, StringTypes):
-                        db.runOperation("""INSERT INTO
-                            pickup_players_games(game_id, name, game, time)
-                            VALUES(?, ?, ?, ?)
-                        """, (id_, player, game.nick, itime()))
-                    else:
-                        _insertPlayers(player)
-            _insertPlayers(players)
+            txn.executemany("""
+                INSERT INTO
+                pickup_players_games(game_id, name, game, time, team, captain)
+                VALUES(?, ?, ?, ?, ?, ?)
+            """, [(id_, name, game.nick, time_, team, int(captain))
+                for name, team, captain in _participants(players, captains)])
+
+            if self.daily_counts:
+                day = time_ // 86400
+                counts = [(game.nick, day, name) for name in _flatten(players)]
+                txn.executemany("""
+                    INSERT OR IGNORE INTO
+                    pickup_player_counts(game, day, name, count)
+                    VALUES(?, ?, ?, 0)
+                """, counts)
+                txn.executemany("""
+                    UPDATE  pickup_player_counts
+                    SET     count = count + 1
+                    WHERE   game=? AND day=? AND name=?
+                """, counts)
+
+            self._count_stats(txn, game.nick, time_, players, captains)
             return id_
         def _gotId(id_):
-            self.pypickupbot.cmsg("Lastgame id: {0}".format(id_))
+            self.pypickupbot.msg(game.pickup.channel,
+                "Lastgame id: {0}".format(id_))
             self.pypickupbot.fire('pickup_lastgame_id', id_, game, players, captains)
         return db.runInteraction(_insertGame).addCallback(_gotId)
 
@@ -319,6 +819,7 @@ class PlayerTracking:
         'top10': (top10, 0),
         'lastgame': (lastgame, 0),
         'lastgames': (lastgames, 0),
+        'stats': (stats, 0),
         'cleargames': (clearGames, COMMAND.ADMIN),
         'purgegames': (purgeGames, COMMAND.ADMIN),
         }
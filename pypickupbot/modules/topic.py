@@ -69,7 +69,7 @@ class TopicMgt:
                 self.motd[i].update(self.motd_str[i])
 
     def motd_from_str(self, s):
-        sep = config.get('Topic', 'separator').decode('string-escape')
+        sep = config.getescaped('Topic', 'separator')
         self.motd_str = re.split(
             '%s|%s' % (
                 re.escape(sep),
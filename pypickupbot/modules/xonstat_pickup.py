@@ -23,11 +23,11 @@
 """Pickup-related commands"""
 from time import time
 from datetime import datetime
+from math import ceil
 import random
-import json
-import httplib
 import re
 
+from twisted.internet import defer
 from twisted.python import log
 
 from pypickupbot.modable import SimpleModuleFactory
@@ -35,55 +35,57 @@ from pypickupbot.irc import COMMAND, InputError, FetchedList
 from pypickupbot.topic import Topic
 from pypickupbot import db
 from pypickupbot import config
+from pypickupbot import xonstat
+from pypickupbot import balance
 from pypickupbot.misc import str_from_timediff, timediff_from_str,\
-    InvalidTimeDiffString, StringTypes, itime
+    InvalidTimeDiffString, StringTypes, itime, SubstringIndex, irc_lower
+
+def xonstat_gametype(gamenick):
+    """The Xonstat game type a pickup game counts as, from [Xonstat Games]"""
+    for target in config.options('Xonstat Games'):
+        if gamenick.lower() in config.getlist('Xonstat Games', target):
+            return target.lower()
+    return None
 
 class Player:
 
-    def __init__(self, nick, playerid = None, create_dt = None, index = None):
+    def __init__(self, nick, playerid = None, create_dt = None, index = None,
+            saved_stripped_nick = None):
         self.nick           = nick
         self.playerid       = playerid
         self.create_dt      = create_dt
         self.index          = index
         self.player_info    = None
+        self.saved_stripped_nick = saved_stripped_nick
 
     def __str__(self):
         return "{0} (#{1})".format(self.nick, self.playerid)
 
     def get_xonstat_url(self):
         """return xontat url for specific player"""
-        return config.get("Xonstat Interface", "url").decode('string-escape') + "player/" + str(self.playerid)
+        return config.getescaped("Xonstat Interface", "url") + "player/" + str(self.playerid)
 
     def get_id(self):
         return self.playerid
 
-    def _get_xonstat_json(self, request):
-        server = config.get("Xonstat Interface", "server").decode('string-escape')
-	data = ""
-        try:
-            http = httplib.HTTPConnection(server)
-            http.connect()
-            http.request("GET", request)
-            response = http.getresponse()
-            data = response.read()
-            http.close()
-        except:
-            return {}
-        json_data = json.loads(data)
-        return json_data[0]  # dict embedded in a list
+    def get_player_info(self):
+        """Gets this player's Xonstat profile through the shared cache
+
+        @returns: a deferred fired with the profile dict, which is empty
+            if it couldn't be retrieved"""
+        def _gotInfo(info):
+            self.player_info = info
+            return info
+        return xonstat.get_player_info(self.playerid).addCallback(_gotInfo)
 
-    def _get_player_info(self):
-        if not self.player_info:
-            self.player_info = self._get_xonstat_json("/player/{0}.json".format(self.playerid))
-        return self.player_info
+    def _info(self):
+        """Last retrieved profile, see L{get_player_info}"""
+        return self.player_info or {}
 
     def is_valid(self):
-        self._get_player_info()
-        if not self.player_info:
-            return False
-        if len(self.player_info) == 0:
-            return False
-        return True
+        def _gotInfo(info):
+            return bool(info)
+        return self.get_player_info().addCallback(_gotInfo)
 
     def _irc_colors(self, qstr, bold=False):
         _irc_colors = [ -1, 4, 9, 8, 12, 11, 13, -1, -1, -1 ]
@@ -162,64 +164,94 @@ class Player:
         result += "\017"
         return result
     
-    def get_nick(self):
+    def game_nick(self):
         try:
-            nick = self._get_player_info()['player']['nick']
-        except:
+            nick = self._info()['player']['nick']
+        except (KeyError, TypeError):
             nick = self.nick
         return self._irc_colors(nick, bold=True)
-    
-    def get_stripped_nick(self):
-        return self._get_player_info()['player']['stripped_nick']
 
-    def get_elo_dict(self):
-        return self._get_player_info()['elos']
+    def stripped_nick(self):
+        try:
+            return self._info()['player']['stripped_nick']
+        except (KeyError, TypeError):
+            return self.saved_stripped_nick or self.nick
 
-    def get_rank_dict(self):
-        return self._get_player_info()['ranks']
+    def elo_dict(self):
+        return self._info().get('elos', {})
 
-    def get_elo(self, gametype):
+    def rank_dict(self):
+        return self._info().get('ranks', {})
+
+    def elo(self, gametype):
         gt = self._get_gametype(gametype)
-        try:
-            elos = self._get_player_info()['elos']
-            if elos.has_key(gt):
-                return elos[gt]['elo']
-        except:
-            pass
+        elos = self.elo_dict()
+        if elos.has_key(gt):
+            return elos[gt]['elo']
         return None
 
-    def get_rank(self, gametype):
+    def rank(self, gametype):
         gt = self._get_gametype(gametype)
-        try:
-            ranks = self._get_player_info()['ranks']
-            if ranks.has_key(gt):
-                return (ranks[gt]['rank'], ranks[gt]['max_rank'])
-        except:
-            pass
+        ranks = self.rank_dict()
+        if ranks.has_key(gt):
+            return (ranks[gt]['rank'], ranks[gt]['max_rank'])
         return (None, None)
-    
+
+    def get_nick(self):
+        return self.get_player_info().addCallback(
+            lambda info: self.game_nick())
+
+    def get_stripped_nick(self):
+        return self.get_player_info().addCallback(
+            lambda info: self.stripped_nick())
+
+    def get_elo(self, gametype):
+        return self.get_player_info().addCallback(
+            lambda info: self.elo(gametype))
+
+    def get_rank(self, gametype):
+        return self.get_player_info().addCallback(
+            lambda info: self.rank(gametype))
+
     def _get_gametype(self, gamenick):
-        for target,games in config.items('Xonstat Games'):
-            games = [ x.strip() for x in games.decode('string-escape').split(",") ]
-            if gamenick.lower() in games:
-                return target.lower()
-        return None    
+        return xonstat_gametype(gamenick)
+
+
+class PlayerEntries:
+    """Players' entries in the lists of a starting game's messages, each
+    rendered once however many messages list them"""
 
+    def __init__(self):
+        self.player_entries = {}
+        self.captain_entries = {}
+
+    def _entry(self, entries, option, player):
+        if player not in entries:
+            entries[player] = config.gettemplate('Pickup messages', option)\
+                .render({
+                    'name': player.nick,
+                    'playerid': player.playerid,
+                    }, nick=player.game_nick)
+        return entries[player]
+
+    def playerlist(self, players):
+        return ', '.join([
+            self._entry(self.player_entries, 'game ready player', player)
+            for player in players])
+
+    def captainlist(self, captains):
+        return ', '.join([
+            self._entry(self.captain_entries, 'game ready captain', player)
+            for player in captains])
 
 class Team:
 
     def __init__(self, name, gametype):
         self.players    = []
         self.name       = name
-        self.gametype   = ""
+        self.gametype   = xonstat_gametype(gametype) or ""
         self.elo        = 0
         self.captain    = None
-        
-        for target,games in config.items('Xonstat Games'):
-            games = [ x.strip() for x in games.decode('string-escape').split(",") ]
-            if gametype in games:
-                self.gametype = target.lower()
-                break
 
     def is_valid(self):
         return (self.gametype != None)
@@ -232,14 +264,14 @@ class Team:
 
     def add_player(self, player):
         self.players.append(player)
-        elo = player.get_elo(self.gametype)
+        elo = player.elo(self.gametype)
         if elo:
             self.elo += elo
 
     def remove_player(self, player):
         for p in self.players:
             if p == player:
-                elo = player.get_elo()
+                elo = player.elo(self.gametype)
                 if elo:
                     self.elo -= elo
                 self.players.remove(p)
@@ -252,23 +284,9 @@ class Team:
         except:
             return 0
 
-    def auto_add_player(self, other, pickpool):
-        elo_diff = self.mean_elo() - other.mean_elo()
-        elo = None
-        player = None
-        for p in pickpool:
-            p_elo = p.get_elo(self.gametype)
-            if not elo or (elo_diff >  0 and p_elo < elo) or (elo_diff <= 0 and p_elo > elo):
-                elo = p_elo
-                player = p
-                
-        print self.name + ": auto-adding {0} ({1} elo)".format(player.nick, player.get_elo(self.gametype))
-        self.add_player(player)
-        return player
-
 
 class Game:
-    """A game that can be played in the channel"""
+    """A game that can be played in a channel"""
     def __init__(self, pickup, nick, name, captains=2, players=8, autopick=True, **kwargs):
         self.pickup = pickup
         self.xonstat = pickup.xonstat
@@ -287,20 +305,39 @@ class Game:
         self.players = []
         self.starting = False
         self.abort_start = False
+        self.prefetch_at = int(ceil(
+            config.getfloat('Pickup', 'prefetch threshold') * self.maxplayers))
         
         if 'teamnames' in kwargs:
             self.teamnames = config.getlist('Pickup: '+nick, 'teamnames')
         else:
             self.teamnames = []
 
+    def get_pool(self, players):
+        """Turns nicks into L{Player}s, registered ones when possible"""
+        pool = []
+        for p in players:
+            player = self.xonstat._find_player(
+                self.xonstat._get_original_nick(p))
+            pool.append(player or Player(p, None))
+        return pool
+
+    def prefetch(self):
+        """Retrieves every signed up player's profile ahead of the start
+
+        @returns: a deferred fired once all profiles are in the cache"""
+        return defer.gatherResults([player.get_player_info()
+            for player in self.get_pool(self.players)])
+
     def pre_start(self):
         """Initiates a game's start"""
         self.starting = True
+        self.prefetch()
         start = self.pickup.pypickupbot.fire('pickup_game_pre_start', self)
 
         def _knowStart(start):
             if not start:
-                self.pickup.pypickupbot.cmsg(
+                self.pickup.pypickupbot.msg(self.pickup.channel,
                     _("%s game about to start..")%self.name
                 )
             else:
@@ -331,14 +368,14 @@ class Game:
             return
 
         players = self.players[:self.maxplayers]
-        for player in players:
-            self.pickup.all_games().force_remove(player)
+        # they can't play in another channel meanwhile
+        self.pickup.module.all_games().force_remove_many(players)
 
         self.pickup.update_topic()
 
-        self.pickup.pypickupbot.notice(self.pickup.pypickupbot.channel, 
+        self.pickup.pypickupbot.notice(self.pickup.channel, 
             _("%(gamenick)s game ready to start in %(channel)s")
-                % {'gamenick': self.nick, 'channel': self.pickup.pypickupbot.channel})
+                % {'gamenick': self.nick, 'channel': self.pickup.channel})
 
         # flatten player list ([[a,b],[c,d]] -> [a,b,c,d])
         for p in players:  # flatten list
@@ -346,6 +383,17 @@ class Game:
                 players.remove(p)
                 players.extend(p)
         
+        pool = self.get_pool(players)
+
+        # Profiles are normally already cached by prefetch(), the rest of the
+        # start only reads what has been retrieved here
+        d = defer.gatherResults([player.get_player_info() for player in pool])
+        d.addCallback(lambda infos: self._start(pool))
+        d.addErrback(log.err, "starting {0} game".format(self.nick))
+        return d
+
+    def _start(self, pool):
+        """Picks captains and teams, then announces the game"""
         # Set up teams
         # TODO - randomly constructed team names ("adjective + verb" scheme) ?
         gametype = self.nick
@@ -360,15 +408,7 @@ class Game:
         captains = []
         
         if not self.autopick:
-            pickpool = []
-            for p in players:
-                nick = self.xonstat._get_original_nick(p)
-                if self.xonstat.players.has_key(nick):
-                    player = self.xonstat.players[nick]
-                    pickpool.append(player)
-                    continue
-                pickpool.append(Player(p, None))
-
+            pickpool = pool
             players = sorted(pickpool)
             captains = random.sample(pickpool, self.caps)
 
@@ -378,167 +418,70 @@ class Game:
             captainlist = [ c.nick.encode('utf-8') for c in captains ]
             self.pickup.pypickupbot.fire('pickup_game_starting', self, playerlist, captainlist)
 
+            entries = PlayerEntries()
             if len(captains) > 0:
-                cmsg = config.get('Pickup messages', 'game ready').decode('string-escape')%\
+                cmsg = config.gettemplate('Pickup messages', 'game ready') % \
                     {
                         'nick': self.nick,
                         'playernum': len(self.players),
                         'playermax': self.maxplayers,
                         'name': self.name,
                         'numcaps': self.caps,
-                        'playerlist': ', '.join([
-                                config.get('Pickup messages', 'game ready player').decode('string-escape')%
-                                {
-                                    'nick': player.get_nick(),
-                                    'name': player.nick(),
-                                    'playerid': player.playerid,
-                                }
-                                for player in players]),
-                        'captainlist': ', '.join([
-                                config.get('Pickup messages', 'game ready captain').decode('string-escape')%
-                                {
-                                    'nick': player.get_nick(),
-                                    'name': player.nick(),
-                                    'playerid': player.playerid,
-                                }
-                                for player in captains]),
+                        'playerlist': entries.playerlist(players),
+                        'captainlist': entries.captainlist(captains),
                     }
-                self.pickup.pypickupbot.cmsg(cmsg.encode('utf-8'))
-                
-                if config.getboolean("Pickup", "PM each player on start"):
-                    for player in players:
-                        msg = config.get("Pickup messages", "youre needed").decode('string-escape')%\
-                            {
-                                'channel': self.pickup.pypickupbot.channel,
-                                'name': self.name,
-                                'nick': self.nick,
-                                'numcaps': self.caps,
-                                'playerlist': ', '.join([
-                                    config.get('Pickup messages', 'game ready player').decode('string-escape')%
-                                    {
-                                        'nick': player.get_nick(),
-                                        'name': player.nick,
-                                        'playerid': player.playerid,
-                                    }
-                                    for player in players]),
-                                'captainlist': ', '.join([
-                                config.get('Pickup messages', 'game ready captain').decode('string-escape')%
-                                    {
-                                        'nick': player.get_nick(),
-                                        'name': player.nick,
-                                        'playerid': player.playerid,
-                                    }
-                                    for player in captains]),
-                            }
-                        self.pickup.pypickupbot.msg(player, msg.encode('utf-8'))
-                        
+                self.pickup.pypickupbot.msg(self.pickup.channel, cmsg.encode('utf-8'))
+                self._pm_players(players, 'youre needed', entries, captains)
             else:
-                cmsg = config.get('Pickup messages', 'game ready nocaptains').decode('string-escape')%\
+                cmsg = config.gettemplate('Pickup messages', 'game ready nocaptains') % \
                     {
                         'nick': self.nick,
                         'playernum': len(self.players),
                         'playermax': self.maxplayers,
                         'name': self.name,
                         'numcaps': self.caps,
-                        'playerlist': ', '.join([
-                                config.get('Pickup messages', 'game ready player').decode('string-escape')%
-                                {
-                                    'nick': player.get_nick(),
-                                    'name': player.nick,
-                                    'playerid': player.playerid,
-                                }
-                                for player in players]),
+                        'playerlist': entries.playerlist(players),
                     }
-                self.pickup.pypickupbot.cmsg(cmsg.encode('utf-8'))
-
-                if config.getboolean("Pickup", "PM each player on start"):
-                    for player in players:
-                        msg  = config.get("Pickup messages", "youre needed nocaptains").decode('string-escape')%\
-                            {
-                                'channel': self.pickup.pypickupbot.channel,
-                                'name': self.name,
-                                'nick': self.nick,
-                                'numcaps': self.caps,
-                                'playerlist': ', '.join([
-                                    config.get('Pickup messages', 'game ready player').decode('string-escape')%
-                                    {
-                                        'nick': player.get_nick(),
-                                        'name': player.nick,
-                                        'playerid': player.playerid,
-                                    }
-                                    for player in players]),
-                            }
-                        self.pickup.pypickupbot.msg(player, msg.encode('utf-8'))
+                self.pickup.pypickupbot.msg(self.pickup.channel, cmsg.encode('utf-8'))
+                self._pm_players(players, 'youre needed nocaptains', entries)
 
         else:  # if not self.autopick
-            # Create a pickpool containing Player instances
-            pickpool = []
-            pickpool_noelo = []
-            for p in players:
-                nick = self.xonstat._get_original_nick(p)
-                if self.xonstat.players.has_key(nick):
-                    player = self.xonstat.players[nick]
-                    if player.get_elo(gametype):
-                        pickpool.append(player)
-                        continue
-                pickpool_noelo.append(Player(p, None))
-
-            print "Elo:", pickpool
-            print "No Elo:", pickpool_noelo
-            
-            # Shuffle pickpool for later use
-            random.shuffle(pickpool)
-            random.shuffle(pickpool_noelo)
-            
-            # Randomly select one captain, then select other one with similar elo
-            # FIXME - only two teams are supported currently - FIXME
-            team1, team2 = teams[:2]
+            ratings = [(player, player.elo(gametype)) for player in pool]
+            random.shuffle(ratings)
+
+            # Captains have similar elos and each lead their own team
+            captain_ids = balance.pick_captains(ratings, len(teams))
+            captains = [ratings[i][0] for i in captain_ids]
+            captain_elos = [ratings[i][1] for i in captain_ids]
             captain_elo_diff = "???"
-            if len(pickpool) > 0:
-                team1.captain = random.choice(pickpool)
-                best_diff = None
-                for p in pickpool:
-                    if p == team1.captain:
-                        continue
-                    elo_diff = team1.captain.get_elo(gametype) - p.get_elo(gametype)
-                    if not best_diff or elo_diff < best_diff:
-                        team2.captain = p
-                        best_diff = elo_diff
-                if team2.captain:
-                    captain_elo_diff = round(abs(best_diff),1)
-                else:
-                    team2.captain = random.choice(pickpool_noelo)
-                print "Autopick captains:", team1.captain, ",", team2.captain, "(elo diff:", captain_elo_diff, ")"
-            else:
-                team1.captain, team2.captain = random.sample(pickpool_noelo, 2)
-                print "Random captains:", team1.captain, ",", team2.captain
-                
-            players = pickpool + pickpool_noelo
-            captains = [ team1.captain, team2.captain ]
-
-            # auto-select players (based on elo)
-            while len(pickpool):
-                p = team1.auto_add_player(team2, pickpool)
-                pickpool.remove(p)
-                team1, team2 = team2, team1  # swap
-                
-            # randomly pick remaining players
-            while len(pickpool_noelo):
-                p = random.choice(pickpool_noelo)
-                team1.add_player(p)
-                pickpool_noelo.remove(p)
-                team1, team2 = team2, team1  # swap
+            if captain_elos and None not in captain_elos:
+                captain_elo_diff = round(max(captain_elos) - min(captain_elos), 1)
+            for team, captain in zip(teams, captains):
+                team.captain = captain
 
-            if len(team1.players) != len(team2.players):
-                print "Teams have different sizes:", team1, team2
+            result = balance.balance(ratings, len(teams),
+                fixed=dict((i, t) for t, i in enumerate(captain_ids)),
+                method=config.get('Pickup', 'autopick method'),
+                budget=config.getfloat('Pickup', 'autopick time budget') / 1000)
+            for team, members in zip(teams, result.teams):
+                for player in members:
+                    team.add_player(player)
+            elo_gap = round(result.gap, 1)
 
-            print players, teams
+            print "Autopick captains:", captains, "(elo diff:", captain_elo_diff, ")"
+            print "Autopick teams:", result, [str(team) for team in teams]
+
+            players = [player for player, elo in ratings]
 
             playerlist  = [p.nick.encode('utf-8') for p in players]
             captainlist = [c.nick.encode('utf-8') for c in captains]
-            self.pickup.pypickupbot.fire('pickup_game_starting', self, playerlist, captainlist)
+            teamlist    = [[p.nick.encode('utf-8') for p in team.players]
+                for team in teams]
+            self.pickup.pypickupbot.fire('pickup_game_starting', self, teamlist, captainlist)
 
-            cmsg = config.get('Pickup messages', 'game ready autopick').decode('string-escape')%\
+            entries = PlayerEntries()
+            team_template = config.gettemplate('Pickup messages', 'game ready autopick team')
+            cmsg = config.gettemplate('Pickup messages', 'game ready autopick') % \
                 {
                     'nick': self.nick,
                     'playernum': len(players),
@@ -546,62 +489,42 @@ class Game:
                     'name': self.name,
                     'numcaps': self.caps,
                     'teamslist': ', '.join([
-                        config.get('Pickup messages', 'game ready autopick team').decode('string-escape')%
+                        team_template.render(
                         {
                             'name': team.name,
-                            'players': ', '.join([
-                                config.get('Pickup messages', 'game ready player').decode('string-escape')%
-                                {
-                                    'nick': player.get_nick(),
-                                    'name': player.nick,
-                                    'playerid': player.playerid,
-                                }
-                                for player in team.players]),
-                            'mean_elo': round(team.mean_elo(),1),
-                        }
+                        },
+                            players=lambda: entries.playerlist(team.players),
+                            mean_elo=lambda: round(team.mean_elo(),1),
+                        )
                         for team in teams]),
-                    'captainlist': ', '.join([
-                                config.get('Pickup messages', 'game ready captain').decode('string-escape')%
-                                {
-                                    'nick': player.get_nick(),
-                                    'name': player.nick,
-                                    'playerid': player.playerid,
-                                }
-                                for player in captains]),
+                    'captainlist': entries.captainlist(captains),
                     'elo_diff': captain_elo_diff,
+                    'elo_gap': elo_gap,
                 }
-            self.pickup.pypickupbot.cmsg(cmsg.encode('utf-8'))
-                
-            if config.getboolean("Pickup", "PM each player on start"):
-                for player in players:
-                    msg = config.get("Pickup messages", "youre needed").decode('string-escape')%\
-                        {
-                            'channel': self.pickup.pypickupbot.channel,
-                            'name': self.name,
-                            'nick': self.nick,
-                            'numcaps': self.caps,
-                            'playerlist': ', '.join([
-                                config.get('Pickup messages', 'game ready player').decode('string-escape')%
-                                {
-                                    'nick': player.get_nick(),
-                                    'name': player.nick,
-                                    'playerid': player.playerid,
-                                }
-                                for player in players]),
-                            'captainlist': ', '.join([
-                                config.get('Pickup messages', 'game ready captain').decode('string-escape')%
-                                {
-                                    'nick': player.get_nick(),
-                                    'name': player.nick,
-                                    'playerid': player.playerid,
-                                }
-                                for player in captains]),
-                        }
-                    self.pickup.pypickupbot.msg(player, msg.encode('utf-8'))
+            self.pickup.pypickupbot.msg(self.pickup.channel, cmsg.encode('utf-8'))
+            self._pm_players(players, 'youre needed', entries, captains)
 
         self.pickup.pypickupbot.fire('pickup_game_started', self, playerlist, captainlist)
         self.starting = False
 
+    def _pm_players(self, players, template, entries, captains=None):
+        """Sends every player the same message, if enabled"""
+        if not config.getboolean("Pickup", "PM each player on start"):
+            return
+        values = {
+            'channel': self.pickup.channel,
+            'name': self.name,
+            'nick': self.nick,
+            'numcaps': self.caps,
+            }
+        lazy = {'playerlist': lambda: entries.playerlist(players)}
+        if captains != None:
+            lazy['captainlist'] = lambda: entries.captainlist(captains)
+        msg = config.gettemplate("Pickup messages", template)\
+            .render(values, **lazy).encode('utf-8')
+        self.pickup.pypickupbot.msg_many(
+            [player.nick.encode('utf-8') for player in players], msg)
+
     def teamname(self, i):
         if len(self.teamnames) > i:
             return self.teamnames[i]
@@ -613,6 +536,8 @@ class Game:
         if user not in self.players:
             self.players.append(user)
             self.pickup.update_topic()
+            if self.prefetch_at <= len(self.players) < self.maxplayers:
+                self.prefetch()
         
         if len(self.players) >= self.maxplayers:
             self.pre_start()
@@ -621,7 +546,7 @@ class Game:
     def who(self):
         """Who is in this game"""
         if len(self.players):
-            return config.get('Pickup messages', 'who game').decode('string-escape')%\
+            return config.getescaped('Pickup messages', 'who game')%\
                 {'nick': self.nick, 'playernum': len(self.players), 'playermax': self.maxplayers,
                 'name': self.name, 'numcaps': self.caps, 'playerlist': ', '.join(self.players) }
 
@@ -641,6 +566,19 @@ class Game:
         except ValueError:
             pass
 
+    def force_remove_many(self, users, update_topic=True):
+        """Removes several players at once
+
+        @returns: whether any of them was removed"""
+        users = set(users)
+        players = [player for player in self.players if player not in users]
+        if len(players) == len(self.players):
+            return False
+        self.players = players
+        if update_topic:
+            self.pickup.update_topic()
+        return True
+
     def rename(self, oldnick, newnick):
         """Rename a player"""
         try:
@@ -660,6 +598,11 @@ class Games(Game):
         for game in self.games: game.pre_start(*args)
     def force_remove(self, *args):
         for game in self.games: game.force_remove(*args)
+    def force_remove_many(self, users):
+        removed = [game for game in self.games
+            if game.force_remove_many(users, update_topic=False)]
+        for pickup in set(game.pickup for game in removed):
+            pickup.update_topic()
     def rename(self, *args):
         for game in self.games: game.rename(*args)
 
@@ -685,11 +628,17 @@ class Games(Game):
 class XonstatInterface:
 
     def __init__(self):
-        self.players = {}       # nick : playerid
+        self.players = {}       # current nick : Player, see _rename_user
+        self.by_lower = {}      # lowercase nick : nicks, latest last
+        self.by_playerid = {}   # playerid : set of nicks
+        self.stripped = SubstringIndex() # nick : stripped nick
+
+        xonstat.Xonstat.get_cache().listeners.append(self._profile_updated)
 
         def _done(args):
-            self._load_from_db()
-        d = db.runOperation("""
+            self._load_from_db().addCallback(self._fetch_missing_nicks)
+        d = db.migrate('xonstat_players', [
+            """
             CREATE TABLE IF NOT EXISTS
             xonstat_players
             (
@@ -697,73 +646,209 @@ class XonstatInterface:
                 nick        TEXT,
                 playerid    INTEGER,
                 create_dt   INTEGER
-            )""")
+            )""",
+            self._add_stripped_nick,
+            ])
         d.addCallback(_done)
-        
+
+    def _add_stripped_nick(self, txn):
+        txn.execute("PRAGMA table_info(xonstat_players)")
+        if 'stripped_nick' not in [column[1] for column in txn.fetchall()]:
+            txn.execute("""
+                ALTER TABLE xonstat_players
+                ADD COLUMN  stripped_nick TEXT
+                """)
+
     def _load_from_db(self):
         d = db.runQuery("""
-            SELECT      id, nick, playerid, create_dt
+            SELECT      id, nick, playerid, create_dt, stripped_nick
             FROM        xonstat_players
             ORDER BY    create_dt
             """)
-        self.players = {}
         def _loadPlayers(r):
+            # keep players that didn't change, along with their profiles
+            known = dict((p.index, p) for p in self.players.itervalues())
+            self._clear()
             for entry in r:
-                index, nick, playerid, create_dt = entry
-                self.players[nick] = Player(nick, playerid, create_dt, index)
+                index, nick, playerid, create_dt, stripped_nick = entry
+                player = known.get(index)
+                if player == None or (player.nick, player.playerid) \
+                        != (nick, playerid):
+                    player = Player(nick, playerid, create_dt, index)
+                player.saved_stripped_nick = stripped_nick
+                self._add_player(nick, player)
         return d.addCallback(_loadPlayers)
 
+    def _fetch_missing_nicks(self, *args):
+        """Retrieves in the background the game nicks that were never
+        saved, L{_profile_updated} stores them as they arrive
+
+        Profiles are fetched a few at a time and bypass the shared cache, so
+        that a large backlog neither hogs the Xonstat connections nor
+        evicts the profiles of the players being looked up in the
+        meantime."""
+        cache = xonstat.Xonstat.get_cache()
+        missing = []
+        for playerid in set(int(p.playerid) for p in self.players.itervalues()
+                if p.saved_stripped_nick == None and p.playerid != None):
+            info = cache.peek(playerid)
+            if info:
+                self._profile_updated(playerid, info)
+            else:
+                missing.append(playerid)
+        chunk = xonstat.Xonstat.get_client().semaphore.limit
+
+        def _next_chunk(*args):
+            if not missing:
+                return
+            ds = []
+            for playerid in missing[:chunk]:
+                d = xonstat.fetch_player_info(playerid)
+                d.addCallback(lambda info, playerid=playerid:
+                    self._profile_updated(playerid, info))
+                ds.append(d)
+            del missing[:chunk]
+            defer.DeferredList(ds, consumeErrors=True)\
+                .addCallback(_next_chunk)
+        _next_chunk()
+
+    def _profile_updated(self, playerid, info):
+        """Saves and indexes a registered player's new game nick"""
+        try:
+            stripped_nick = info['player']['stripped_nick']
+        except KeyError:
+            return
+        nicks = [nick for nick in self.by_playerid.get(playerid, ())
+            if self.players[nick].saved_stripped_nick != stripped_nick]
+        if not nicks:
+            return
+        for nick in nicks:
+            self.players[nick].saved_stripped_nick = stripped_nick
+            self._index_stripped(nick, self.players[nick])
+        d = db.runOperation("""
+            UPDATE  xonstat_players
+            SET     stripped_nick=?
+            WHERE   playerid=?
+            """, (stripped_nick, playerid))
+        return d.addErrback(log.err,
+            "saving game nick of Xonstat player #{0}".format(playerid))
+
+    def _clear(self):
+        self.players = {}
+        self.by_lower = {}
+        self.by_playerid = {}
+        self.stripped.clear()
+
+    def _add_player(self, nick, player):
+        """Registers player under nick in every index"""
+        self._remove_player(nick)
+        self.players[nick] = player
+        self.by_lower.setdefault(nick.lower(), []).append(nick)
+        if player.playerid != None:
+            self.by_playerid.setdefault(int(player.playerid), set()).add(nick)
+            if not player.player_info:
+                player.player_info = xonstat.Xonstat.get_cache()\
+                    .peek(int(player.playerid))
+        self._index_stripped(nick, player)
+        if player.player_info:
+            self._profile_updated(int(player.playerid), player.player_info)
+
+    def _remove_player(self, nick):
+        player = self.players.pop(nick, None)
+        if player == None:
+            return None
+        nicks = self.by_lower[nick.lower()]
+        nicks.remove(nick)
+        if not nicks:
+            del self.by_lower[nick.lower()]
+        if player.playerid != None:
+            nicks = self.by_playerid.get(int(player.playerid), set())
+            nicks.discard(nick)
+            if not nicks:
+                self.by_playerid.pop(int(player.playerid), None)
+        self.stripped.remove(nick)
+        return player
+
+    def _index_stripped(self, nick, player):
+        if self.players.get(nick) is player:
+            self.stripped.add(nick, player.saved_stripped_nick or nick)
+
     def _find_player(self, nick):
-        if self.players.has_key(nick):
-            return self.players[nick]
+        nicks = self.by_lower.get(nick.lower())
+        if nicks:
+            return self.players[nicks[-1]]
         return None
 
     def _find_playerid(self, playerid):
-        result = {}
-        for k,p in self.players.items():
-            if int(p.playerid) == int(playerid):
-                result[k] = p
-        return result
+        try:
+            nicks = self.by_playerid.get(int(playerid), ())
+        except ValueError:
+            return {}
+        return dict((nick, self.players[nick]) for nick in nicks)
 
     def _search(self, string):
-        result = {}
-        for k,p in self.players.items():
-            if string.lower() in p.get_stripped_nick().lower():
-                result[k] = p
-        return result
+        """Finds players by their saved game nick, or their nick if it
+        isn't known yet
+
+        @returns: {nick: L{Player}} of matching players"""
+        return dict((k, self.players[k]) for k in self.stripped.search(string))
+
+    def _forget(self, test):
+        """Removes the players test returns True for from memory"""
+        for k in [k for k, p in self.players.items() if test(p)]:
+            self._remove_player(k)
 
     def _purge(self, keep=0):
         """used by clearPlayers and purgePlayers"""
-        d = defer.gatherResults(
-            db.runOperation("""
-                DELETE FROM xonstat_players
-                WHERE       create_dt < ?
-                """, (itime() - keep,))
-            )
+        limit = itime() - keep
+        d = db.runOperation("""
+            DELETE FROM xonstat_players
+            WHERE       create_dt < ?
+            """, (limit,))
+        def _purged(r):
+            self._forget(lambda p: p.create_dt < limit)
         def onErr(failure):
             log.err(failure, "purge players, keep = {0}".format(keep))
             return failure
-        d.addErrback(onErr)
+        d.addCallbacks(_purged, onErr)
         return d
 
     def _delete(self, nick):
         if nick.startswith("#"):
             index = int(nick[1:])
-            return db.runOperation("""
+            d = db.runOperation("""
                 DELETE FROM xonstat_players
                 WHERE       id=?
                 """, (index,))
+            test = lambda p: p.index == index
         else:
-            return db.runOperation("""
+            d = db.runOperation("""
                 DELETE FROM xonstat_players
                 WHERE       nick=?
                 """, (nick,))
-
-    def _insert(self, nick, playerid):
-        return db.runOperation("""
-            INSERT INTO xonstat_players(nick, playerid, create_dt)
-            VALUES      (:nick, :playerid, :ctime)
-            """, (nick, playerid, itime(),))
+            test = lambda p: p.nick == nick
+        return d.addCallback(lambda r: self._forget(test))
+
+    def _insert(self, nick, playerid, player=None):
+        """Registers nick to playerid
+
+        @param player: L{Player} to keep, with whatever profile it already
+            retrieved, instead of creating a new one
+        @returns: a deferred fired with the registered L{Player}"""
+        if player == None:
+            player = Player(nick, playerid)
+        player.create_dt = itime()
+        def _insert(txn):
+            txn.execute("""
+                INSERT INTO xonstat_players(nick, playerid, create_dt)
+                VALUES      (:nick, :playerid, :ctime)
+                """, (nick, playerid, player.create_dt,))
+            return txn.lastrowid
+        def _inserted(index):
+            player.index = index
+            self._add_player(nick, player)
+            return player
+        return db.runInteraction(_insert).addCallback(_inserted)
 
     def _get_nick(self, nick):
         return nick
@@ -772,15 +857,51 @@ class XonstatInterface:
         return nick
 
     def _rename_user(self, oldname, newname):
-        try:
-            self.players[newname] = self.players[oldname]
-            del self.players[oldname]
-        except:
-            pass
+        """Follows a registered player's nick changes in memory only, their
+        registration stays under L{Player.nick}. Registrations of newname
+        aren't replaced."""
+        nicks = self.by_lower.get(oldname.lower())
+        if not nicks or newname.lower() in self.by_lower:
+            return
+        self._add_player(newname, self._remove_player(nicks[-1]))
     
 
-class XonstatPickupBot:
-    """Allows the bot to run games with captain-picked teams"""
+class ChannelPickups:
+    """The games of one channel"""
+
+    def __init__(self, module, bot, channel):
+        """Reads games from config"""
+        self.module = module
+        self.xonstat = module.xonstat
+        self.pypickupbot = bot
+        self.channel = channel
+        self.topic = None
+        self.games = {}
+        self.order = []
+        self.last_promote = 0
+
+        for (gamenick, gamename) in config.items('Pickup games'):
+            if gamenick == 'order':
+                self.order = config.getlist('Pickup games', 'order')
+            else:
+                if config.has_section('Pickup: '+gamenick):
+                    gamesettings = dict(config.items('Pickup: '+gamenick))
+                else:
+                    gamesettings = {}
+                self.games[gamenick] = Game(
+                    self,
+                    gamenick, gamename,
+                    **gamesettings)
+                if gamenick not in self.order:
+                    self.order.append(gamenick)
+
+        self.order = filter(lambda x: x in self.games, self.order)
+
+    def joined(self, context):
+        """when the channel is joined, set topic"""
+        if config.get('Pickup', 'topic'):
+            self.topic = context.topic.add('', Topic.GRAVITY_BEGINNING)
+            self.update_topic()
 
     def all_games(self):
         """Gets a wrapper for all games"""
@@ -820,7 +941,7 @@ class XonstatPickupBot:
         """Update the pickup part of the channel topic"""
         config_topic = config.getint('Pickup', 'topic')
 
-        if not config_topic:
+        if not config_topic or self.topic == None:
             return
 
         out = []
@@ -828,7 +949,7 @@ class XonstatPickupBot:
             game = self.games[gamenick]
             if config_topic == 1 or game.players:
                 out.append(
-                    config.get('Pickup messages', 'topic game').decode('string-escape')
+                    config.getescaped('Pickup messages', 'topic game')
                     % {
                         'nick': game.nick, 'playernum': len(game.players),
                         'playermax': game.maxplayers, 'name': game.name,
@@ -836,11 +957,39 @@ class XonstatPickupBot:
                     })
 
         self.topic.update(
-            config.get('Pickup messages', 'topic game separator')\
-                .decode('string-escape')\
+            config.getescaped('Pickup messages', 'topic game separator')\
             .join(out)
             )
 
+class XonstatPickupBot:
+    """Allows the bot to run games with captain-picked teams, in as many
+    channels as set in the config, all sharing the Xonstat player registry"""
+
+    def all_games(self):
+        """Gets a wrapper for the games of all channels"""
+        return Games([game for pickups in self.channels.itervalues()
+            for game in pickups.games.itervalues()])
+
+    def get_pickups(self, call):
+        """Gets the games of the channel the call was made in, or of the
+        first pickup channel for private messages"""
+        if call.channel == 'PM':
+            channel = self.home
+        else:
+            channel = irc_lower(call.channel)
+        try:
+            return self.channels[channel]
+        except KeyError:
+            raise InputError(_("There are no pickups in this channel."))
+
+    def get_games(self, call, args, implicit_all=True):
+        """Gets all or some games of the call's channel"""
+        return self.get_pickups(call).get_games(call, args, implicit_all)
+
+    def get_game(self, call, args):
+        """Get one game of the call's channel"""
+        return self.get_pickups(call).get_game(call, args)
+
     def add(self, call, args):
         """!add [game [game ..]]
 
@@ -875,17 +1024,17 @@ class XonstatPickupBot:
 	"""
         games = [i for i in self.get_games(call, args).who() if i != None]
         all = False
-        if len(args) < 1 or len(args) == len(self.games):
+        if len(args) < 1 or len(args) == len(self.get_pickups(call).games):
             all = True
         if len(games):
             if all:
-                call.reply(_("All games:")+" "+config.get('Pickup messages', 'who game separator').decode('string-escape').join(games),
+                call.reply(_("All games:")+" "+config.getescaped('Pickup messages', 'who game separator').join(games),
 
 
-                    config.get('Pickup messages', 'who game separator').decode('string-escape'))
+                    config.getescaped('Pickup messages', 'who game separator'))
             else:
-                call.reply(config.get('Pickup messages', 'who game separator').decode('string-escape').join(games),
-                    config.get('Pickup messages', 'who game separator').decode('string-escape'))
+                call.reply(config.getescaped('Pickup messages', 'who game separator').join(games),
+                    config.getescaped('Pickup messages', 'who game separator'))
         else:
             if all:
                 call.reply(_("No game going on!"))
@@ -898,29 +1047,30 @@ class XonstatPickupBot:
         Shows a notice encouraging players to sign up for the specified game.
 	"""
         admin = self.pypickupbot.is_admin(call.user, call.nick)
+        pickups = self.get_pickups(call)
 
         def _knowAdmin(admin):
-            if self.last_promote + config.getint('Pickup', 'promote delay') > time() \
+            if pickups.last_promote + config.getint('Pickup', 'promote delay') > time() \
                     and not admin:
                 raise InputError(_("Can't promote so often."))
 
-            game = self.get_game(call, args)
+            game = pickups.get_game(call, args)
 
             if call.nick not in game.players \
                     and not admin:
                 raise InputError(_("Join the game yourself before promoting it."))
 
-            self.last_promote = time()
-            cmsg = config.get('Pickup messages', 'promote').decode('string-escape')%\
+            pickups.last_promote = time()
+            cmsg = config.getescaped('Pickup messages', 'promote')%\
                 {
                     'bold': '\x02', 'prefix': config.get('Bot', 'command prefix'),
                     'name': game.name, 'nick': game.nick,
                     'command': config.get('Bot', 'command prefix')+'add '+game.nick,
-                    'channel': self.pypickupbot.channel,
+                    'channel': pickups.channel,
                     'playersneeded': game.maxplayers-len(game.players),
                     'maxplayers': game.maxplayers, 'numplayers': len(game.players),
                 }
-            self.pypickupbot.cmsg(cmsg.encode('utf-8'))
+            self.pypickupbot.msg(pickups.channel, cmsg.encode('utf-8'))
         return admin.addCallbacks(_knowAdmin)
 
     def pull(self, call, args):
@@ -955,7 +1105,7 @@ class XonstatPickupBot:
         """
         call.reply( ', '.join(
                 ["%s (%s)" % (nick, game.name)
-                for nick, game in self.games.iteritems()
+                for nick, game in self.get_pickups(call).games.iteritems()
                 if not args or args[0] in nick or args[0] in game.name.lower()]
             ), ', ')
 
@@ -1007,18 +1157,22 @@ class XonstatPickupBot:
             call.reply(_("No players found."))
             return
     
-        def do_call(is_op):
+        def do_call(results):
+            is_op, gamenick = results
             keys = sorted(players.keys())
             if is_op:
-                reply = config.get("Xonstat Interface", "player whois").decode('string-escape')%\
+                reply = config.getescaped("Xonstat Interface", "player whois")%\
                         { 'players': ", ".join(["{0} ({1})".format(k, players[k].index) for k in keys]),
-                          'num_players': len(players), 'gamenick': players.values()[0].get_stripped_nick(), }
+                          'num_players': len(players), 'gamenick': gamenick, }
             else:        
-                reply = config.get("Xonstat Interface", "player whois").decode('string-escape')%\
+                reply = config.getescaped("Xonstat Interface", "player whois")%\
                         { 'players': ", ".join(["{0}".format(k) for k in keys]),
-                          'num_players': len(players), 'gamenick': players.values()[0].get_stripped_nick(), }
+                          'num_players': len(players), 'gamenick': gamenick, }
             call.reply(reply)
-        FetchedList.has_flag(self.pypickupbot, self.pypickupbot.channel, call.nick, 'o').addCallback(do_call)        
+        return defer.gatherResults([
+            FetchedList.has_flag(self.pypickupbot, self.pypickupbot.channel, call.nick, 'o'),
+            players.values()[0].get_stripped_nick(),
+            ]).addCallback(do_call)
 
     def listPlayers(self, call, args):
         """!listplayers
@@ -1033,11 +1187,11 @@ class XonstatPickupBot:
         def do_call(is_op):
             keys = sorted(players.keys())
             if is_op:
-                reply = config.get("Xonstat Interface", "player list").decode('string-escape')%\
+                reply = config.getescaped("Xonstat Interface", "player list")%\
                         { 'players': ", ".join(["{0} ({1})".format(k, players[k].index) for k in keys]),
                           'num_players': len(players), }
             else:        
-                reply = config.get("Xonstat Interface", "player list").decode('string-escape')%\
+                reply = config.getescaped("Xonstat Interface", "player list")%\
                         { 'players': ", ".join(["{0}".format(k) for k in keys]),
                           'num_players': len(players), }
             call.reply(reply)
@@ -1055,8 +1209,8 @@ class XonstatPickupBot:
         if len(players) == 0:
             call.reply(_("No players found."))
             return
-        
-        reply = config.get("Xonstat Interface", "player search").decode('string-escape')%\
+
+        reply = config.getescaped("Xonstat Interface", "player search")%\
                 { 'players': ", ".join([ "({1}) {0}".format(k, players[k].index) for k in players.keys() ]),
                   'num_players': len(players), }
         call.reply(reply)
@@ -1075,50 +1229,52 @@ class XonstatPickupBot:
             call.reply(_("No player named <{0}> found!").format(nick))
             return
         
-        sep = config.get("Xonstat Interface", "playerinfo separator").decode('string-escape')
+        def _gotInfo(info):
+            sep = config.getescaped("Xonstat Interface", "playerinfo separator")
             
-        elo_list = []
-        for gametype,elo in player.get_elo_dict().items():
-            if gametype == 'overall':
-                continue
-            eloscore, games = round(elo['elo'], 1), elo['games']
-            entry = config.get("Xonstat Interface", "playerinfo elo entry").decode('string-escape')%\
-                { 'gametype':gametype, 'elo':eloscore, }
-            if games < 8:
-                # don't show elos with little number of games
-                continue
-            if games < 32:
-                entry += "*"
-            elo_list.append(entry)
-        elo_list.sort()
-        elo_display = sep.join(elo_list)
-        if len(elo_list) == 0:
-            elo_display = _("none yet")
+            elo_list = []
+            for gametype,elo in player.elo_dict().items():
+                if gametype == 'overall':
+                    continue
+                eloscore, games = round(elo['elo'], 1), elo['games']
+                entry = config.getescaped("Xonstat Interface", "playerinfo elo entry")%\
+                    { 'gametype':gametype, 'elo':eloscore, }
+                if games < 8:
+                    # don't show elos with little number of games
+                    continue
+                if games < 32:
+                    entry += "*"
+                elo_list.append(entry)
+            elo_list.sort()
+            elo_display = sep.join(elo_list)
+            if len(elo_list) == 0:
+                elo_display = _("none yet")
         
-        rank_list = []
-        for gametype,rank in player.get_rank_dict().items():
-            if gametype == 'overall':
-                continue
-            rank, max_rank = rank['rank'], rank['max_rank']
-            entry = config.get("Xonstat Interface", "playerinfo rank entry").decode('string-escape')%\
-                { 'gametype':gametype, 'rank':rank, 'max_rank':max_rank, }
-            rank_list.append(entry)
-        rank_list.sort()
-        rank_display = sep.join(rank_list)
-        if len(rank_list) == 0:
-            rank_display = _("none yet")
+            rank_list = []
+            for gametype,rank in player.rank_dict().items():
+                if gametype == 'overall':
+                    continue
+                rank, max_rank = rank['rank'], rank['max_rank']
+                entry = config.getescaped("Xonstat Interface", "playerinfo rank entry")%\
+                    { 'gametype':gametype, 'rank':rank, 'max_rank':max_rank, }
+                rank_list.append(entry)
+            rank_list.sort()
+            rank_display = sep.join(rank_list)
+            if len(rank_list) == 0:
+                rank_display = _("none yet")
         
-        reply = config.get("Xonstat Interface", "playerinfo").decode('string-escape')%\
-                { 'nick': nick, 'gamenick': player.get_nick(), }
-        if len(elo_list) > 0:
-            reply += config.get("Xonstat Interface", "playerinfo elos").decode('string-escape')%\
-                { 'elos': elo_display }
-        if len(rank_list) > 0:
-            reply += config.get("Xonstat Interface", "playerinfo ranks").decode('string-escape')%\
-                { 'ranks': rank_display, }
-        reply += config.get("Xonstat Interface", "playerinfo profile").decode('string-escape')%\
-            { 'profile': player.get_xonstat_url(), }
-        call.reply(reply)
+            reply = config.getescaped("Xonstat Interface", "playerinfo")%\
+                    { 'nick': nick, 'gamenick': player.game_nick(), }
+            if len(elo_list) > 0:
+                reply += config.getescaped("Xonstat Interface", "playerinfo elos")%\
+                    { 'elos': elo_display }
+            if len(rank_list) > 0:
+                reply += config.getescaped("Xonstat Interface", "playerinfo ranks")%\
+                    { 'ranks': rank_display, }
+            reply += config.getescaped("Xonstat Interface", "playerinfo profile")%\
+                { 'profile': player.get_xonstat_url(), }
+            call.reply(reply)
+        return player.get_player_info().addCallback(_gotInfo)
 
     def playerExists(self, call, args):
         """!playerexists <nick>
@@ -1139,6 +1295,23 @@ class XonstatPickupBot:
             reply = _("No player information found for <{0}>.".format(nick))
         call.reply(reply)
 
+    def reloadPlayers(self, call, args):
+        """!reloadplayers
+
+        Reloads the registered players list from the database, eg. after editing it by hand."""
+        def done(*args):
+            call.reply(_("Done, %d players registered.") % len(self.xonstat.players))
+        return self.xonstat._load_from_db().addCallback(done)
+
+    def cacheStats(self, call, args):
+        """!xonstatcache
+
+        Shows how well the Xonstat profile cache performs."""
+        stats = xonstat.Xonstat.get_cache().stats()
+        call.reply(_("Xonstat cache: %(entries)d/%(size)d profiles, "
+            "%(hits)d hits, %(stale_hits)d stale hits, %(misses)d misses, "
+            "%(evictions)d evictions") % stats)
+
     def register(self, call, args):
         """!register <xonstat #id>
 
@@ -1174,26 +1347,26 @@ class XonstatPickupBot:
                     format(playerid))
 
         player = Player(nick, playerid)
-        if not player.is_valid():
-            raise InputError(_("This doesn't seem to be a valid Xonstat playerid!"))
 
-        d = call.confirm(_("You're about to register yourself with player id #{0} ({1}, " + \
-                "Xonstat profile {2}), is this correct?").\
-                format(player.get_id(), player.get_stripped_nick(), player.get_xonstat_url()))
-        def _confirmed(ret):
-            if ret:
-                def done(*args):
-                    def done(*args):
-                        player = self.xonstat._find_player(nick)
+        def _validated(valid):
+            if not valid:
+                raise InputError(_("This doesn't seem to be a valid Xonstat playerid!"))
+
+            d = call.confirm(_("You're about to register yourself with player id #{0} ({1}, " + \
+                    "Xonstat profile {2}), is this correct?").\
+                    format(player.get_id(), player.stripped_nick(), player.get_xonstat_url()))
+            def _confirmed(ret):
+                if ret:
+                    def done(player):
                         call.reply("Done.")
-                        msg = config.get('Xonstat Interface', 'player registered').decode('string-escape')%\
-                            { 'nick': nick, 'playerid': playerid, 'gamenick': player.get_nick(), 'profile': player.get_xonstat_url(), }
+                        msg = config.getescaped('Xonstat Interface', 'player registered')%\
+                            { 'nick': nick, 'playerid': playerid, 'gamenick': player.game_nick(), 'profile': player.get_xonstat_url(), }
                         self.pypickupbot.msg( self.pypickupbot.channel, msg.encode("utf-8") )
-                    self.xonstat._load_from_db().addCallback(done)
-                self.xonstat._insert(nick, playerid).addCallback(done)
-            else:
-                call.reply(_("Cancelled."))
-        d.addCallback(_confirmed)
+                    return self.xonstat._insert(nick, playerid, player).addCallback(done)
+                else:
+                    call.reply(_("Cancelled."))
+            return d.addCallback(_confirmed)
+        return player.is_valid().addCallback(_validated)
 
     def removePlayer(self, call, args):
         """!removeplayer <nick|index>
@@ -1209,10 +1382,7 @@ class XonstatPickupBot:
         def _confirmed(ret):
             if ret:
                 def done(*args):
-                   def done(*args):
-                        call.reply(_("Done."))
-                   d = self.xonstat._load_from_db()
-                   d.addCallback(done)
+                    call.reply(_("Done."))
                 return self.xonstat._delete(nick).addCallback(done)
             else:
                 call.reply(_("Cancelled."))
@@ -1225,37 +1395,23 @@ class XonstatPickupBot:
         self.xonstat = XonstatInterface()
         self.bot = bot
         
-        self.games = {}
-        self.order = []
-        self.last_promote = 0
+        self.channels = {}  # irc_lower(channel) : ChannelPickups
+        channels = filter(None, config.getlist('Pickup', 'channels')) \
+            or [bot.channel]
+        self.home = irc_lower(channels[0])
         if not config.has_section('Pickup games'):
             log.err('Could not find section "Pickup games" of the config!')
             return
-        games = config.items('Pickup games')
-#        log.msg(games)
-
-        for (gamenick, gamename) in games:
-            if gamenick == 'order':
-                self.order = config.getlist('Pickup games', 'order')
-            else:
-                if config.has_section('Pickup: '+gamenick):
-                    gamesettings = dict(config.items('Pickup: '+gamenick))
-                else:
-                    gamesettings = {}
-                self.games[gamenick] = Game(
-                    self,
-                    gamenick, gamename,
-                    **gamesettings)
-                if gamenick not in self.order:
-                    self.order.append(gamenick)
 
-        self.order = filter(lambda x: x in self.games, self.order)
+        for channel in channels:
+            self.channels[irc_lower(channel)] = \
+                ChannelPickups(self, bot, channel)
 
-    def joinedHomeChannel(self):
-        """when home channel joined, set topic"""
-        if config.get('Pickup', 'topic'):
-            self.topic = self.pypickupbot.topic.add('', Topic.GRAVITY_BEGINNING)
-            self.update_topic()
+    def joinedChannel(self, context):
+        """when a pickup channel is joined, set its topic"""
+        pickups = self.channels.get(irc_lower(context.name))
+        if pickups:
+            pickups.joined(context)
 
     def userRenamed(self, oldname, newname):
         """track user renames"""
@@ -1264,12 +1420,14 @@ class XonstatPickupBot:
 
     def userLeft(self, user, channel, *args):
         """track quitters"""
-        if channel == self.pypickupbot.channel:
-            self.all_games().force_remove(user.split('!')[0])
+        pickups = self.channels.get(irc_lower(channel))
+        if pickups:
+            pickups.all_games().force_remove(user.split('!')[0])
     
-    def userQuit(self, user, quitMessage):
-        """track quitters"""
-        self.all_games().force_remove(user.split('!')[0])
+    def usersQuit(self, users):
+        """track quitters, all of a netsplit at once"""
+        self.all_games().force_remove_many(
+            [user.split('!')[0] for user, quitMessage in users])
 
     commands = {
         'add':              (add,           COMMAND.NOT_FROM_PM),
@@ -1297,14 +1455,16 @@ class XonstatPickupBot:
         'removeplayer':     (removePlayer,  COMMAND.NOT_FROM_PM | COMMAND.ADMIN),
         'clearplayers':     (clearPlayers,  COMMAND.NOT_FROM_PM | COMMAND.ADMIN),
         'purgeplayers':     (purgePlayers,  COMMAND.NOT_FROM_PM | COMMAND.ADMIN),
+        'reloadplayers':    (reloadPlayers, COMMAND.ADMIN),
+        'xonstatcache':     (cacheStats,    COMMAND.ADMIN),
         }
 
     eventhandlers = {
-        'joinedHomeChannel':    joinedHomeChannel,
+        'joinedChannel':        joinedChannel,
         'userRenamed':          userRenamed,
         'userLeft':             userLeft,
         'userKicked':           userLeft,
-        'userQuit':             userQuit,
+        'usersQuit':            usersQuit,
     }
 
 xonstat_pickup = SimpleModuleFactory(XonstatPickupBot)
@@ -0,0 +1,130 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""outgoing lines flood control"""
+
+from collections import deque
+
+from twisted.internet import reactor
+
+MAX_LINE_LENGTH = 510
+"""Longest line servers accept, without the line terminator"""
+
+class SendQueue:
+    """Sends lines to the server as fast as its flood control allows
+
+    Up to burst lines go out at once, then rate lines per second (a token
+    bucket), a rate of 0 sends lines as they come. Lines of the NORMAL
+    lane, like replies and channel messages, go before BULK ones, like the
+    messages sent to every player of a game.
+
+    Lines of a lane sending the same message or notice to different
+    targets are merged into one line with several targets, up to as many as
+    L{targets} allows for the command."""
+
+    NORMAL = 0
+    BULK = 1
+
+    mergeable = ('PRIVMSG', 'NOTICE')
+
+    def __init__(self, send, burst, rate, targets=lambda command: 1,
+            clock=reactor):
+        """
+        @param send: function actually sending a line
+        @param targets: function returning how many targets a command can
+            be given at once, None for any number"""
+        self.send = send
+        self.burst = burst
+        self.rate = rate
+        self.targets = targets
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock.seconds()
+        self.lanes = [deque(), deque()]
+        self.next_send = None
+
+    def __len__(self):
+        return sum(len(lane) for lane in self.lanes)
+
+    def put(self, line, lane=NORMAL):
+        self.lanes[lane].append(line)
+        if self.next_send == None:
+            # once the lines queued along with this one are in, so that
+            # they can be merged and lanes are respected
+            self.next_send = self.clock.callLater(0, self._send)
+
+    def clear(self):
+        if self.next_send != None and self.next_send.active():
+            self.next_send.cancel()
+        self.next_send = None
+        for lane in self.lanes:
+            lane.clear()
+
+    def _refill(self):
+        now = self.clock.seconds()
+        self.tokens = min(float(self.burst),
+            self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _send(self):
+        self.next_send = None
+        self._refill()
+        unthrottled = self.rate <= 0
+        while unthrottled or self.tokens >= 1:
+            for lane in self.lanes:
+                if lane:
+                    break
+            else:
+                return
+            self.send(self._merge(lane))
+            if not unthrottled:
+                self.tokens -= 1
+        if len(self):
+            self.next_send = self.clock.callLater(
+                (1 - self.tokens) / self.rate, self._send)
+
+    def _merge(self, lane):
+        """Takes the next line out of lane, along with the following ones
+        it can be merged with"""
+        line = lane.popleft()
+        if not lane:
+            return line
+        try:
+            command, targets, text = line.split(' ', 2)
+        except ValueError:
+            return line
+        if command not in self.mergeable:
+            return line
+        max_targets = self.targets(command)
+        targets = [targets]
+        while lane and (max_targets == None or len(targets) < max_targets):
+            try:
+                command_, target, text_ = lane[0].split(' ', 2)
+            except ValueError:
+                break
+            merged = ' '.join([command, ','.join(targets + [target]), text])
+            if command_ != command or text_ != text \
+                    or len(merged) > MAX_LINE_LENGTH:
+                break
+            targets.append(target)
+            lane.popleft()
+        return ' '.join([command, ','.join(targets), text])
@@ -26,17 +26,18 @@ from twisted.internet import reactor
 from pypickupbot import config
 
 class Topic:
-    """the channel's topic"""
+    """a channel's topic"""
 
     GRAVITY_BEGINNING = 0
     GRAVITY_NONE = 1
     GRAVITY_END = 2
 
-    def __init__(self, bot):
+    def __init__(self, bot, channel):
         self.parts = {}
         self.num = 0
         self.update_call = None
         self.bot = bot
+        self.channel = channel
 
     def add(self, text, gravity=GRAVITY_NONE):
         """Adds something to the topic
@@ -63,15 +64,19 @@ class Topic:
 
     def update(self):
         """updates the channel topic"""
+        self.cancel()
+        self.update_call = reactor.callLater(2, self._update)
+
+    def cancel(self):
+        """drops a pending update, for topics that are replaced"""
         if self.update_call != None and self.update_call.active():
             self.update_call.cancel()
-        self.update_call = reactor.callLater(2, self._update)
 
     def _update(self):
         """actually updates the channel topic
 
         use L{update} instead"""
-        self.bot.setTopic(self.bot.channel, str(self))
+        self.bot.setTopic(self.channel, str(self))
 
     def __str__(self):
         sorted_topic = {
@@ -87,7 +92,7 @@ class Topic:
         for i in [self.GRAVITY_BEGINNING, self.GRAVITY_NONE, self.GRAVITY_END]:
             as_list.extend(sorted_topic[i].values())
 
-        return config.get('Topic', 'prefix').decode('string-escape') + config.get('Topic', 'separator').decode('string-escape').join(as_list) + config.get('Topic', 'suffix').decode('string-escape')
+        return config.getescaped('Topic', 'prefix') + config.getescaped('Topic', 'separator').join(as_list) + config.getescaped('Topic', 'suffix')
 
 class TopicPart:
     """part of the channel's topic"""
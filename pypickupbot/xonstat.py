@@ -0,0 +1,252 @@
+# pypickupbot - An ircbot that helps game players to play organized games
+#               with captain-picked teams.
+#     Copyright (C) 2010 pypickupbot authors
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+"""Non-blocking access to Xonstat"""
+
+import json
+from collections import OrderedDict
+from time import time
+
+from twisted.internet import defer, reactor
+from twisted.python import log
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+
+from pypickupbot import config
+
+class XonstatError(Exception):
+    pass
+
+class XonstatClient:
+    """Fetches JSON documents from a Xonstat server.
+
+    Requests go through twisted's HTTP agent, reuse kept-alive connections
+    and at most L{concurrency} of them are in flight at the same time.
+    """
+
+    def __init__(self, server, timeout=10, connect_timeout=5, concurrency=4,
+            persistent=4):
+        self.server = server
+        self.timeout = timeout
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = persistent
+        self.agent = Agent(reactor, connectTimeout=connect_timeout,
+            pool=self.pool)
+        self.semaphore = defer.DeferredSemaphore(concurrency)
+
+    @classmethod
+    def from_config(cls):
+        return cls(
+            config.getescaped('Xonstat Interface', 'server'),
+            timeout=config.getfloat('Xonstat Interface', 'timeout'),
+            connect_timeout=config.getfloat('Xonstat Interface',
+                'connect timeout'),
+            concurrency=config.getint('Xonstat Interface',
+                'max concurrent requests'),
+            persistent=config.getint('Xonstat Interface',
+                'max persistent connections'),
+            )
+
+    def get_json(self, path):
+        """Retrieves and decodes path from the server
+
+        @returns: a deferred fired with the decoded document"""
+        return self.semaphore.run(self._request, path)
+
+    def _request(self, path):
+        url = 'http://%s%s' % (self.server, path)
+        d = self.agent.request('GET', url, Headers({
+            'Accept': ['application/json'],
+            }))
+        timeout = reactor.callLater(self.timeout, d.cancel)
+
+        def _gotResponse(response):
+            body = readBody(response)
+            if response.code != 200:
+                def _badStatus(body):
+                    raise XonstatError("%s returned HTTP status %d"
+                        % (url, response.code))
+                body.addCallback(_badStatus)
+            return body
+
+        def _stopTimeout(result):
+            if timeout.active():
+                timeout.cancel()
+            return result
+
+        d.addCallback(_gotResponse)
+        d.addBoth(_stopTimeout)
+        return d.addCallback(json.loads)
+
+    def close(self):
+        """Drops kept-alive connections"""
+        return self.pool.closeCachedConnections()
+
+class PlayerInfoCache:
+    """Process-wide cache of Xonstat profiles, keyed by player id.
+
+    Entries younger than L{ttl} are served as they are. Older entries are
+    still served right away while a refresh happens in the background,
+    unless they are older than L{max_age}, in which case the caller waits for
+    fresh data. Only L{size} entries are kept, least recently used first out.
+
+    Callables in L{listeners} are called with the player id and profile
+    whenever a profile is retrieved from Xonstat.
+    """
+
+    def __init__(self, fetch, ttl, max_age, size):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_age = max_age
+        self.size = size
+        self.entries = OrderedDict() # playerid: (info, fetch time)
+        self.pending = {}            # playerid: deferred
+        self.listeners = []
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, playerid):
+        """@returns: a deferred fired with the player's profile"""
+        entry = self.entries.pop(playerid, None)
+        if entry != None:
+            self.entries[playerid] = entry
+            info, fetched = entry
+            age = time() - fetched
+            if age < self.ttl:
+                self.hits += 1
+                return defer.succeed(info)
+            elif age < self.max_age:
+                self.stale_hits += 1
+                self._refresh(playerid)
+                return defer.succeed(info)
+        self.misses += 1
+        return self._refresh(playerid)
+
+    def peek(self, playerid):
+        """Cached profile if any, without fetching it"""
+        entry = self.entries.get(playerid)
+        if entry != None:
+            return entry[0]
+
+    def _refresh(self, playerid):
+        fetching = self.pending.get(playerid)
+        if fetching == None:
+            fetching = self.pending[playerid] = self.fetch(playerid)
+            fetching.addCallback(self._store, playerid)
+
+        d = defer.Deferred()
+        def _cb(info):
+            d.callback(info)
+            return info
+        fetching.addCallback(_cb)
+        return d
+
+    def _store(self, info, playerid):
+        self.pending.pop(playerid, None)
+        if not info:
+            # keep serving what we had rather than forgetting the player
+            return self.peek(playerid) or info
+        self.entries.pop(playerid, None)
+        self.entries[playerid] = (info, time())
+        while len(self.entries) > self.size:
+            self.entries.popitem(False)
+            self.evictions += 1
+        for listener in self.listeners:
+            try:
+                listener(playerid, info)
+            except:
+                log.err(None, "notifying of Xonstat player #{0}".format(playerid))
+        return info
+
+    def invalidate(self, playerid):
+        self.entries.pop(playerid, None)
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'size': self.size,
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            }
+
+class Xonstat:
+    client = None
+    cache = None
+
+    @classmethod
+    def get_client(cls):
+        if cls.client == None:
+            cls.client = XonstatClient.from_config()
+            reactor.addSystemEventTrigger('before', 'shutdown',
+                cls.client.close)
+        return cls.client
+
+    @classmethod
+    def get_cache(cls):
+        if cls.cache == None:
+            cls.cache = PlayerInfoCache(fetch_player_info,
+                ttl=config.getduration('Xonstat Interface',
+                    'player cache ttl'),
+                max_age=config.getduration('Xonstat Interface',
+                    'player cache max age'),
+                size=config.getint('Xonstat Interface',
+                    'player cache size'),
+                )
+        return cls.cache
+
+def get_json(path):
+    return Xonstat.get_client().get_json(path)
+
+def get_player_info(playerid):
+    """Gets a player's profile, from the cache when possible
+
+    @returns: a deferred fired with the player's info dict, which is empty
+        if it couldn't be retrieved"""
+    if playerid == None:
+        return defer.succeed({})
+    return Xonstat.get_cache().get(int(playerid))
+
+def fetch_player_info(playerid):
+    """Fetches a player's profile from Xonstat
+
+    @returns: a deferred fired with the player's info dict, or an empty dict
+        if it couldn't be retrieved"""
+    if playerid == None:
+        return defer.succeed({})
+
+    d = get_json("/player/{0}.json".format(playerid))
+
+    def _gotInfo(info):
+        return info[0] # dict embedded in a list
+
+    def _onErr(failure):
+        if failure.check(XonstatError):
+            log.msg(failure.getErrorMessage())
+        else:
+            log.err(failure, "fetching Xonstat player #{0}".format(playerid))
+        return {}
+
+    return d.addCallback(_gotInfo).addErrback(_onErr)